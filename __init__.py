@@ -1,3 +1,10 @@
 from .thorin import *
 from .type_table import *
 from .irbuilder import *
+from .world import *
+from .build_cache import *
+from .ffi import *
+from .library import *
+from .passes import *
+from .stats import *
+from .jit import *
@@ -0,0 +1,86 @@
+"""Compares the worklist emitter against a recursive reference walk.
+
+Usage: python benchmarks/bench_emit.py [--nodes N] [--repeat R]
+"""
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+pythorin = importlib.import_module(os.path.basename(ROOT))
+
+
+def build_chain(length):
+    thorin = pythorin.Thorin("bench_chain")
+    int_type = pythorin.ThorinPrimType("qs32")
+    mem_type = pythorin.ThorinMemType()
+    fn_type = pythorin.ThorinFnType([mem_type, int_type, pythorin.ThorinFnType([mem_type, int_type])])
+
+    fn = pythorin.ThorinContinuation(fn_type, external="chain")
+    fn_mem, a, ret = fn.parameters
+    x = a
+    for i in range(length):
+        x = x + i
+    fn(ret, fn_mem, x)
+
+    return thorin, fn
+
+
+def recursive_emit(node, module):
+    if node in module.names:
+        return
+    for operand in node.operands():
+        recursive_emit(operand, module)
+    module.names[node] = node.compile(module)
+    late_operands = node.late_operands()
+    for operand in late_operands:
+        recursive_emit(operand, module)
+    if late_operands:
+        node.finish(module)
+
+
+def run_recursive(thorin, fn):
+    #The recursive walk needs one Python frame per edge, give it enough stack to get through.
+    result = {}
+    def target():
+        sys.setrecursionlimit(10 * 1000 * 1000)
+        start = time.perf_counter()
+        recursive_emit(fn, thorin.module)
+        result["time"] = time.perf_counter() - start
+
+    threading.stack_size(1024 * 1024 * 1024)
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    threading.stack_size(0)
+    return result["time"]
+
+
+def run_worklist(thorin, fn):
+    start = time.perf_counter()
+    thorin.module.emit(fn)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100000, help="length of the arithmetic chain")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    for name, runner in (("recursive", run_recursive), ("worklist", run_worklist)):
+        best = None
+        for i in range(options.repeat):
+            thorin, fn = build_chain(options.nodes)
+            elapsed = runner(thorin, fn)
+            best = elapsed if best is None else min(best, elapsed)
+        defs = len(thorin.module["defs"])
+        print("%-10s %8d defs  %8.3f s  %10.0f defs/s" % (name, defs, best, defs / best))
+
+
+if __name__ == "__main__":
+    main()
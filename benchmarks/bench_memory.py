@@ -0,0 +1,72 @@
+"""Measures the Python heap cost of traced def graphs.
+
+Builds a synthetic graph of about --nodes nodes (arithmetic chains broken up
+into continuations that branch on a comparison) without emitting it, and
+reports bytes per node and the peak RSS of the process.
+
+Usage: python benchmarks/bench_memory.py [--nodes N]
+"""
+import argparse
+import gc
+import importlib
+import os
+import resource
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+pythorin = importlib.import_module(os.path.basename(ROOT))
+
+
+def build_graph(nodes):
+    int_type = pythorin.ThorinPrimType("qs32")
+    mem_type = pythorin.ThorinMemType()
+    ret_type = pythorin.ThorinFnType([mem_type, int_type])
+    block_type = pythorin.ThorinFnType([mem_type, int_type, ret_type])
+
+    roots = []
+    block = None
+    while nodes > 0:
+        next_block = pythorin.ThorinContinuation(block_type)
+        block_mem, x, ret = next_block.parameters
+        for i in range(100):
+            x = x * 3 + i
+        if block is not None:
+            block(next_block, block_mem, x, ret)
+        else:
+            roots.append(next_block)
+        block = next_block
+        nodes -= 604
+    return roots
+
+
+def count_nodes():
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, (pythorin.ThorinDef, pythorin.ThorinType)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=1000 * 1000)
+    options = parser.parse_args()
+
+    #Peak RSS first, tracemalloc's own bookkeeping would inflate it.
+    roots = build_graph(options.nodes)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    nodes = count_nodes()
+    del roots
+    gc.collect()
+
+    tracemalloc.start()
+    roots = build_graph(options.nodes)
+    traced, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("nodes          %d" % nodes)
+    print("traced heap    %.1f MiB" % (traced / 1024 / 1024))
+    print("bytes/node     %.1f" % (traced / nodes))
+    print("peak rss       %.1f MiB" % (peak_rss / 1024))
+
+
+if __name__ == "__main__":
+    main()
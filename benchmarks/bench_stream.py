@@ -0,0 +1,82 @@
+"""Compares writing a module through the in-memory dict against the streaming writer.
+
+Usage: python benchmarks/bench_stream.py [--nodes N]
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+pythorin = importlib.import_module(os.path.basename(ROOT))
+
+
+def build_graph(length):
+    int_type = pythorin.ThorinPrimType("qs32")
+    mem_type = pythorin.ThorinMemType()
+    fn_type = pythorin.ThorinFnType([mem_type, int_type, pythorin.ThorinFnType([mem_type, int_type])])
+
+    fn = pythorin.ThorinContinuation(fn_type, external="chain")
+    fn_mem, a, ret = fn.parameters
+    x = a
+    for i in range(length):
+        x = x * 3 + i
+    fn(ret, fn_mem, x)
+    return fn
+
+
+def in_memory(fn):
+    thorin = pythorin.Thorin("bench_dict")
+    thorin.add_def(fn)
+    with open(thorin.module_name + ".thorin.json", "w+") as f:
+        json.dump(thorin.module, f, indent=2)
+    return len(thorin.module["defs"])
+
+
+def streaming(fn):
+    thorin = pythorin.Thorin("bench_stream", stream=True)
+    thorin.add_def(fn)
+    thorin.finish_stream()
+    return len(thorin.module["defs"])
+
+
+def measure(runner, nodes):
+    #Time and memory are taken in separate runs, tracemalloc slows emission down a lot.
+    fn = build_graph(nodes)
+    gc.collect()
+    start = time.perf_counter()
+    defs = runner(fn)
+    elapsed = time.perf_counter() - start
+
+    fn = build_graph(nodes)
+    gc.collect()
+    tracemalloc.start()
+    runner(fn)
+    traced, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return defs, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100000, help="links in the arithmetic chain")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as build_dir:
+        os.chdir(build_dir)
+        for name, runner in (("in-memory", in_memory), ("streaming", streaming)):
+            defs, elapsed, peak = measure(runner, options.nodes)
+            size = os.path.getsize(os.listdir(".")[0])
+            for output in os.listdir("."):
+                os.remove(output)
+            print("%-10s %8d defs  %8.3f s  %10.0f defs/s  peak %7.1f MiB  file %7.1f MiB" % (name, defs, elapsed, defs / elapsed, peak / 1024 / 1024, size / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
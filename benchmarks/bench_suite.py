@@ -0,0 +1,162 @@
+"""Traces and emits synthetic workloads built from the irbuilder helpers.
+
+Every workload is generated at a size that can be scaled with --scale. For each one the
+time to trace the graph, the time to emit it, the number of defs and type table entries
+produced and the peak Python heap usage (in a separate run, tracemalloc slows things down)
+are reported. Nothing is written to disk and no toolchain is needed.
+
+Usage: python benchmarks/bench_suite.py [--scale S] [--repeat R] [--workload NAME ...]
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+pythorin = importlib.import_module(os.path.basename(ROOT))
+
+int_type = pythorin.ThorinPrimType("qs32")
+mem_type = pythorin.ThorinMemType()
+
+
+def function(name, ret_type, *arg_types):
+    ret_fn_type = pythorin.ThorinFnType([mem_type, ret_type])
+    return pythorin.ThorinContinuation(pythorin.ThorinFnType([mem_type, *arg_types, ret_fn_type]), external=name)
+
+
+def build_chain(size):
+    """One long chain of dependent arithmetic."""
+    fn = function("chain", int_type, int_type)
+    fn_mem, x, ret = fn.parameters
+    for i in range(size):
+        x = x * 3 + x
+    fn(ret, fn_mem, x)
+    return [fn]
+
+
+def build_tuple(size):
+    """Wide tuples and structs, with every element computed from the parameter."""
+    fields = [("f%d" % i, int_type) for i in range(size)]
+    struct_type = pythorin.ThorinStructType("wide", fields)
+    tuple_type = pythorin.ThorinTupleType([int_type] * size)
+
+    struct_fn = function("wide_struct", struct_type, int_type)
+    struct_mem, x, struct_ret = struct_fn.parameters
+    struct_fn(struct_ret, struct_mem, pythorin.ThorinStruct(struct_type, [x * (i + 2) for i in range(size)]))
+
+    tuple_fn = function("wide_tuple", tuple_type, int_type)
+    tuple_mem, y, tuple_ret = tuple_fn.parameters
+    tuple_fn(tuple_ret, tuple_mem, pythorin.ThorinTuple([y * (i + 2) for i in range(size)]))
+    return [struct_fn, tuple_fn]
+
+
+def build_loops(size, depth=3):
+    """size functions with loops nested depth deep."""
+    roots = []
+    for n in range(size):
+        fn = function("loops%d" % n, int_type, int_type)
+        fn_mem, x, ret = fn.parameters
+
+        def nest(level):
+            def body(block, mem, i, next_fn):
+                if level == depth:
+                    block(next_fn, mem)
+                else:
+                    block(*pythorin.thorinRangeFn(mem, 0, i * 2, 1, nest(level + 1), lambda inner, inner_mem: inner(next_fn, inner_mem)))
+            return body
+
+        def done(block, mem):
+            block(ret, mem, x)
+
+        fn(*pythorin.thorinRangeFn(fn_mem, 0, x, 1, nest(1), done))
+        roots.append(fn)
+    return roots
+
+
+def build_diamonds(size):
+    """A sequence of if/else diamonds that join again, each one computing a new value."""
+    fn = function("diamonds", int_type, int_type)
+    mem, x, ret = fn.parameters
+    block = fn
+    for i in range(size):
+        join = pythorin.ThorinContinuation(pythorin.ThorinFnType([mem_type, int_type]))
+        join_mem, join_x = join.parameters
+
+        def branch_true(true_block, true_mem, x=x, join=join):
+            true_block(join, true_mem, x + 7)
+        def branch_false(false_block, false_mem, x=x, join=join):
+            false_block(join, false_mem, x * 3)
+
+        block(*pythorin.thorinBranchFn(mem, x < i, branch_true, branch_false))
+        block, mem, x = join, join_mem, join_x
+    block(ret, mem, x)
+    return [fn]
+
+
+def build_string(size):
+    """A string literal of size characters."""
+    string_type = pythorin.ThorinPointerType(pythorin.ThorinIndefiniteArrayType(pythorin.ThorinPrimType("pu8")))
+    fn = function("string", string_type)
+    fn_mem, ret = fn.parameters
+    fn(ret, fn_mem, pythorin.thorinString("".join(chr(ord("a") + i % 26) for i in range(size))))
+    return [fn]
+
+
+workloads = {
+    "chain": (build_chain, 20000),
+    "tuple": (build_tuple, 5000),
+    "loops": (build_loops, 500),
+    "diamonds": (build_diamonds, 5000),
+    "string": (build_string, 100000),
+}
+
+
+def run(builder, size):
+    start = time.perf_counter()
+    roots = builder(size)
+    trace_time = time.perf_counter() - start
+
+    world = pythorin.ThorinWorld("bench")
+    start = time.perf_counter()
+    for root in roots:
+        root.get(world)
+    emit_time = time.perf_counter() - start
+
+    return trace_time, emit_time, len(world["defs"]), len(world["type_table"])
+
+
+def peak_memory(builder, size):
+    tracemalloc.start()
+    run(builder, size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0, help="factor applied to the default size of every workload")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workload", nargs="*", choices=sorted(workloads), default=list(workloads))
+    options = parser.parse_args()
+
+    print("%-10s %8s %10s %10s %9s %7s %10s" % ("workload", "size", "trace s", "emit s", "defs", "types", "peak MiB"))
+    for name in options.workload:
+        builder, size = workloads[name]
+        size = max(1, int(size * options.scale))
+
+        best_trace = best_emit = None
+        for i in range(options.repeat):
+            trace_time, emit_time, defs, types = run(builder, size)
+            best_trace = trace_time if best_trace is None else min(best_trace, trace_time)
+            best_emit = emit_time if best_emit is None else min(best_emit, emit_time)
+        peak = peak_memory(builder, size)
+
+        print("%-10s %8d %10.3f %10.3f %9d %7d %10.1f" % (name, size, best_trace, best_emit, defs, types, peak / (1024 * 1024)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+
+_tool_identities = {}
+
+def tool_identity(tool):
+    """Path, size and mtime of a toolchain binary; changes whenever the tool gets rebuilt or replaced."""
+    identity = _tool_identities.get(tool)
+    if identity is None:
+        path = shutil.which(tool)
+        if path is None:
+            identity = tool
+        else:
+            stat = os.stat(path)
+            identity = "%s:%d:%d" % (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        _tool_identities[tool] = identity
+    return identity
+
+
+class ThorinBuildCache:
+    """Content addressed store for compiled modules.
+
+    Entries are keyed on the emitted module json together with the identity and flags of the toolchain
+    and evicted least recently used first once the directory grows beyond max_size bytes."""
+    def __init__(self, cache_dir, max_size=None, keep_ir=False):
+        if max_size is None:
+            max_size = int(os.environ.get("THORIN_CACHE_SIZE", 1024 * 1024 * 1024))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.keep_ir = keep_ir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, module_json, commands):
+        """module_json is either the serialized module or a binary file to read it from."""
+        key = hashlib.sha256()
+        for command in commands:
+            key.update(tool_identity(command[0]).encode("utf-8"))
+            for arg in command[1:]:
+                key.update(b"\0" + arg.encode("utf-8"))
+            key.update(b"\n")
+        if isinstance(module_json, str):
+            key.update(module_json.encode("utf-8"))
+        else:
+            for chunk in iter(lambda: module_json.read(1024 * 1024), b""):
+                key.update(chunk)
+        return key.hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def lookup(self, key, suffix=".so"):
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, library, ir=None):
+        files = [(library, ".so")]
+        if self.keep_ir and ir is not None:
+            files.append((ir, ".ll"))
+
+        for source, suffix in files:
+            #Copy next to the final name first, so concurrent builds never see a partial entry.
+            target = self.path(key, suffix)
+            temp = target + ".%d.tmp" % os.getpid()
+            shutil.copyfile(source, temp)
+            os.replace(temp, target)
+
+        self.evict()
+        return self.path(key, ".so")
+
+    def store_data(self, key, suffix, data):
+        target = self.path(key, suffix)
+        temp = target + ".%d.tmp" % os.getpid()
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, target)
+
+        self.evict()
+        return target
+
+    def evict(self):
+        entries = {}
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp") or not entry.is_file():
+                continue
+            key = entry.name.split(".", 1)[0]
+            stat = entry.stat()
+            size, mtime, paths = entries.get(key, (0, 0, []))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime), paths + [entry.path])
+            total_size += stat.st_size
+
+        for key, (size, mtime, paths) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+            if total_size <= self.max_size:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
@@ -0,0 +1,167 @@
+import ctypes
+import sys
+
+from .type_table import *
+
+prim_ctypes = {
+    "bool": ctypes.c_bool,
+    "s8": ctypes.c_int8,
+    "s16": ctypes.c_int16,
+    "s32": ctypes.c_int32,
+    "s64": ctypes.c_int64,
+    "u8": ctypes.c_uint8,
+    "u16": ctypes.c_uint16,
+    "u32": ctypes.c_uint32,
+    "u64": ctypes.c_uint64,
+    "f32": ctypes.c_float,
+    "f64": ctypes.c_double,
+}
+
+def prim_kind(tag):
+    """Strips the precise/quick prefix: ps32 and qs32 are both passed as s32."""
+    if tag == "bool":
+        return tag
+    return tag[1:]
+
+def thorin_ctype(thorin_type):
+    """The ctypes type used to pass a value of the given thorin type, None if there is no C equivalent."""
+    if isinstance(thorin_type, ThorinPrimType):
+        if thorin_type.length != 1:
+            return None
+        return prim_ctypes.get(prim_kind(thorin_type.tag))
+    if isinstance(thorin_type, ThorinPointerType):
+        return ctypes.c_void_p
+    return None
+
+def split_signature(fn_type):
+    """Splits the type of an exported continuation into the C level parameters and return values.
+
+    The mem parameter and the return continuation are not visible on the C side, the return continuation's
+    parameters (minus its mem) make up the return value."""
+    args = list(fn_type.args)
+    if args and isinstance(args[0], ThorinMemType):
+        args = args[1:]
+
+    ret_args = []
+    if args and isinstance(args[-1], ThorinFnType):
+        ret_args = [arg for arg in args[-1].args if not isinstance(arg, ThorinMemType)]
+        args = args[:-1]
+
+    return args, ret_args
+
+def thorin_fn_ctypes(fn_type):
+    """Returns (argtypes, restype) for an exported continuation, or None if the signature can't be expressed."""
+    args, ret_args = split_signature(fn_type)
+
+    argtypes = [thorin_ctype(arg) for arg in args]
+    if None in argtypes:
+        return None
+
+    if len(ret_args) == 0:
+        restype = None
+    elif len(ret_args) == 1:
+        restype = thorin_ctype(ret_args[0])
+        if restype is None:
+            return None
+    else:
+        return None
+
+    return (argtypes, restype)
+
+
+buffer_kinds = {
+    "b": "s", "h": "s", "i": "s", "l": "s", "q": "s", "n": "s",
+    "B": "u", "H": "u", "I": "u", "L": "u", "Q": "u", "N": "u", "c": "u",
+    "e": "f", "f": "f", "d": "f",
+    "?": "bool",
+}
+
+def pointer_element(pointer_type):
+    """The prim type a pointer (to an array) of prims points to, None for anything else."""
+    pointee = pointer_type.pointee
+    if isinstance(pointee, (ThorinIndefiniteArrayType, ThorinDefiniteArrayType)):
+        pointee = pointee.target_type
+    if isinstance(pointee, ThorinPrimType) and pointee.length == 1:
+        return pointee
+    return None
+
+def check_buffer_format(view, elem_type):
+    kind = prim_kind(elem_type.tag)
+    elem_ctype = prim_ctypes.get(kind)
+    if elem_ctype is None:
+        return
+    elem_kind = kind if kind == "bool" else kind[0]
+
+    buffer_format = view.format
+    byte_order = "@"
+    if buffer_format[0] in "@=<>!":
+        byte_order, buffer_format = buffer_format[0].replace("!", ">"), buffer_format[1:]
+    buffer_kind = buffer_kinds.get(buffer_format)
+
+    native = "<" if sys.byteorder == "little" else ">"
+    matches = buffer_kind is not None and byte_order in ("@", "=", native) and view.itemsize == ctypes.sizeof(elem_ctype)
+    if matches and buffer_kind != elem_kind:
+        matches = view.itemsize == 1 and buffer_kind in "su" and elem_kind in "su"
+    if not matches and buffer_format in ("B", "c"):
+        #Untyped bytes (bytearray, mmap) can hold any element type, as long as they hold whole elements.
+        matches = view.nbytes % ctypes.sizeof(elem_ctype) == 0
+    if not matches:
+        raise TypeError("buffer of format '%s' can't be passed as %s" % (view.format, elem_type.tag))
+
+def thorin_buffer_arg(value, elem_type=None):
+    """Converts a pointer argument. Buffer-protocol objects (bytearray, memoryview, mmap, numpy arrays) are passed
+    as a pointer to their data without copying, after checking them against the element type."""
+    if value is None or isinstance(value, (int, bytes, ctypes._SimpleCData, ctypes._Pointer, ctypes.Array)):
+        return value
+
+    view = memoryview(value)
+    if not view.c_contiguous:
+        raise ValueError("only contiguous buffers can be passed as pointers")
+    if elem_type is not None:
+        check_buffer_format(view, elem_type)
+
+    if view.readonly:
+        #Read-only numpy arrays still hand out their address.
+        array_interface = getattr(value, "__array_interface__", None)
+        if array_interface is not None:
+            return array_interface["data"][0]
+        raise TypeError("read-only buffers other than bytes can't be passed as pointers")
+
+    #The ctypes array keeps the buffer exported (and alive) until the call returns.
+    return (ctypes.c_char * view.nbytes).from_buffer(view)
+
+def thorin_pointer_view(address, elem_type, length):
+    """Wraps length elements at address as a numpy array, or as a memoryview when numpy isn't installed.
+    The view does not own the memory."""
+    elem_ctype = prim_ctypes[prim_kind(elem_type.tag)]
+    try:
+        import numpy
+    except ImportError:
+        return memoryview((elem_ctype * length).from_address(address)).cast("B").cast(elem_ctype._type_)
+    return numpy.ctypeslib.as_array(ctypes.cast(address, ctypes.POINTER(elem_ctype)), shape=(length,))
+
+def thorin_fn_wrapper(function, fn_type):
+    """Adds buffer conversion for pointer parameters and a length keyword to wrap a returned pointer.
+    Functions without pointers in their signature are returned unchanged."""
+    args, ret_args = split_signature(fn_type)
+
+    pointer_args = [(i, pointer_element(arg)) for i, arg in enumerate(args) if isinstance(arg, ThorinPointerType)]
+    ret_elem = None
+    if len(ret_args) == 1 and isinstance(ret_args[0], ThorinPointerType):
+        ret_elem = pointer_element(ret_args[0])
+
+    if not pointer_args and ret_elem is None:
+        return function
+
+    def call(*call_args, length=None):
+        call_args = list(call_args)
+        for i, elem_type in pointer_args:
+            call_args[i] = thorin_buffer_arg(call_args[i], elem_type)
+
+        result = function(*call_args)
+
+        if length is not None and ret_elem is not None and result:
+            return thorin_pointer_view(result, ret_elem, length)
+        return result
+
+    return call
@@ -1,54 +1,32 @@
+import math
+import operator
+import struct
+
 from .type_table import *
+from .world import ThorinNode
+from .ffi import prim_ctypes, prim_kind, check_buffer_format
+
+class ThorinDef(ThorinNode):
+    __slots__ = ()
 
-class ThorinDef:
     def __bool__(self):
         assert(False)
-    def __init__(self):
-        self.cache = ""
-    def get(self, module):
-        if self.cache == "":
-            self.cache = self.compile(module)
-        return self.cache
     def __add__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinArithOp("add", [self, other])
+        return thorinArithOp("add", self, other)
     def __sub__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinArithOp("sub", [self, other])
+        return thorinArithOp("sub", self, other)
     def __mul__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinArithOp("mul", [self, other])
+        return thorinArithOp("mul", self, other)
     def __truediv__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinArithOp("div", [self, other])
+        return thorinArithOp("div", self, other)
     def __lt__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinCmp("lt", [self, other])
+        return thorinCmp("lt", self, other)
     def __le__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinCmp("le", [self, other])
+        return thorinCmp("le", self, other)
     def __gt__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinCmp("gt", [self, other])
+        return thorinCmp("gt", self, other)
     def __ge__(self, other):
-        if isinstance(other, int):
-            int_type = ThorinPrimType("qs32")
-            other = ThorinConstant(int_type, other)
-        return ThorinCmp("ge", [self, other])
+        return thorinCmp("ge", self, other)
 
     def __rshift__(self, ptr):
         """This loads a value from memory. THIS IS NOT A SHIFT!"""
@@ -61,10 +39,15 @@ class ThorinDef:
 
 
 class ThorinArithOp(ThorinDef):
+    __slots__ = ("op", "args", "type")
+    operand_fields = ("args",)
+
     def __init__(self, op, args):
         super().__init__()
         self.op = op
         self.args = args
+        #The type of the result, if the first operand's is known. Kept so thorinTypeOf never walks a chain of ops.
+        self.type = thorinTypeOf(args[0]) if args else None
 
     def compile(self, module):
         op = self.op
@@ -72,19 +55,19 @@ class ThorinArithOp(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_arithop_" + str(save_index)
-
-        def_table.append({"type": "arithop", "name": name, "op": op, "args": args})
-        return name
+        return module.add_pure_def("_arithop_", {"type": "arithop", "op": op, "args": args})
 
 
 class ThorinMathOp(ThorinDef):
+    __slots__ = ("op", "args", "type")
+    operand_fields = ("args",)
+
     def __init__(self, op, args):
         super().__init__()
         self.op = op
         self.args = args
+        #The type of the result, if the first operand's is known. Kept so thorinTypeOf never walks a chain of ops.
+        self.type = thorinTypeOf(args[0]) if args else None
 
     def compile(self, module):
         op = self.op
@@ -92,14 +75,12 @@ class ThorinMathOp(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_mathop_" + str(save_index)
-
-        def_table.append({"type": "mathop", "name": name, "op": op, args: args})
-        return name
+        return module.add_pure_def("_mathop_", {"type": "mathop", "op": op, "args": args})
 
 class ThorinParameter(ThorinDef):
+    __slots__ = ("parent", "index")
+    operand_fields = ("parent",)
+
     def __init__(self, parent, index):
         super().__init__()
         self.parent = parent
@@ -111,20 +92,24 @@ class ThorinParameter(ThorinDef):
 
 
 class ThorinContinuation(ThorinDef):
+    __slots__ = ("type", "external", "internal", "intrinsic", "thorin", "filter", "app", "_parameters")
+    operand_fields = ("type",)
+
     def __init__(self, type, external="", internal="", intrinsic="", app=None, filter=None, thorin=None):
         super().__init__()
         self.type = type
         self.external = external
         self.internal = internal
         self.intrinsic = intrinsic
-        self.filter = filter
         self.thorin = thorin
+        self._parameters = None
 
-        self.parameters = []
-
-        for i in range(0, len(type.args)):
-            new_parameter = ThorinParameter(self, i)
-            self.parameters.append(new_parameter)
+        if filter is True or filter is False:
+            bool_type = ThorinPrimType("bool")
+            filter_const = ThorinConstant(bool_type, filter)
+            self.filter = ThorinFilter([filter_const for i in range(0, len(type.args))])
+        else:
+            self.filter = filter
 
         if app is not None and (len(app[1]) == 2 or len(app[1]) == 3) and isinstance(app[1][1], ThorinTuple):
             args = app[1]
@@ -138,11 +123,18 @@ class ThorinContinuation(ThorinDef):
         else:
             self.app = app
 
+    @property
+    def parameters(self):
+        #Most continuations never have their parameters looked at, only create them on demand.
+        if self._parameters is None:
+            self._parameters = [ThorinParameter(self, i) for i in range(0, len(self.type.args))]
+        return self._parameters
+
     def __enter__(self):
         return (self, *self.parameters)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.thorin:
+        if self.thorin and exc_type is None:
             self.thorin.add_def(self)
 
     def __call__(self, target, *args):
@@ -158,15 +150,23 @@ class ThorinContinuation(ThorinDef):
             self.app = (target, args)
 
     def compile(self, module):
+        fntype = self.type.get(module)
+
+        #Declarations of the same intrinsic with the same type are interchangeable, emit them once.
+        intrinsic_key = None
+        if self.intrinsic != "" and not self.app and self.filter is None:
+            intrinsic_key = (self.intrinsic, fntype)
+            name = module.intrinsics.get(intrinsic_key)
+            if name is not None:
+                return name
+
         def_table = module["defs"]
         save_index = len(def_table)
         name = "_continuation_" + str(save_index)
-        self.cache = name
 
-        fntype = self.type.get(module)
         parameters = []
-        for param in self.parameters:
-            parameters.append(param.get(module))
+        for i in range(0, len(self.type.args)):
+            parameters.append(name + "." + str(i))
 
         my_def = {"type": "continuation", "name": name, "fn_type": fntype, "arg_names": parameters}
 
@@ -178,19 +178,32 @@ class ThorinContinuation(ThorinDef):
             my_def.update({"intrinsic": self.intrinsic})
 
         def_table.append(my_def)
+        if intrinsic_key is not None:
+            module.intrinsics[intrinsic_key] = name
+        return name
 
+    def late_operands(self):
+        late_operands = []
+        if self.filter is not None:
+            late_operands.append(self.filter)
+        if self.app:
+            target, args = self.app
+            late_operands.append(target)
+            late_operands.extend(args)
+        return late_operands
+
+    def replace_operands(self, replace):
+        super().replace_operands(replace)
+        if self.filter is not None:
+            self.filter = replace.get(self.filter, self.filter)
+        if self.app:
+            target, args = self.app
+            self.app = (replace.get(target, target), [replace.get(arg, arg) for arg in args])
+
+    def finish(self, module):
         my_filter = None
         if self.filter is not None:
-            if self.filter == True:
-                bool_type = ThorinPrimType("bool")
-                true_const = ThorinConstant(bool_type, True)
-                my_filter = ThorinFilter([true_const for i in range(0, len(self.parameters))]).get(module)
-            elif self.filter == False:
-                bool_type = ThorinPrimType("bool")
-                false_const = ThorinConstant(bool_type, False)
-                my_filter = ThorinFilter([false_const for i in range(0, len(self.parameters))]).get(module)
-            else:
-                my_filter = self.filter.get(module)
+            my_filter = self.filter.get(module)
 
         if self.app:
             target, args = self.app
@@ -198,15 +211,16 @@ class ThorinContinuation(ThorinDef):
             compiled_args = []
             for arg in args:
                 compiled_args.append(arg.get(module))
-            app_def = {"type": "continuation", "name": name, "app": {"target": compiled_target, "args": compiled_args}}
+            app_def = {"type": "continuation", "name": self.get(module), "app": {"target": compiled_target, "args": compiled_args}}
             if my_filter:
                 app_def.update({"filter": my_filter})
-            def_table.append(app_def)
-
-        return name
+            module["defs"].append(app_def)
 
 
 class ThorinConstant(ThorinDef):
+    __slots__ = ("type", "value")
+    operand_fields = ("type",)
+
     def __init__(self, type, value):
         super().__init__()
         self.type = type
@@ -216,30 +230,26 @@ class ThorinConstant(ThorinDef):
         const_type = self.type.get(module)
         value = self.value
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_constant_" + str(save_index)
-
-        def_table.append({"type": "const", "name": name, "const_type": const_type, "value": value})
-        return name
+        return module.add_pure_def("_constant_", {"type": "const", "const_type": const_type, "value": value})
 
 
 class ThorinTop(ThorinDef):
+    __slots__ = ("type",)
+    operand_fields = ("type",)
+
     def __init__(self, type):
         super().__init__()
         self.type = type
     def compile(self, module):
         const_type = self.type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_top_" + str(save_index)
-
-        def_table.append({"type": "top", "name": name, "const_type": const_type})
-        return name
+        return module.add_pure_def("_top_", {"type": "top", "const_type": const_type})
 
 
 class ThorinBottom(ThorinDef):
+    __slots__ = ("type",)
+    operand_fields = ("type",)
+
     def __init__(self, type):
         super().__init__()
         self.type = type
@@ -247,16 +257,13 @@ class ThorinBottom(ThorinDef):
     def compile(self, module):
         const_type = self.type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_bottom_" + str(save_index)
-
-        def_table.append({"type": "bottom", "name": name, "const_type": const_type})
-
-        return name
+        return module.add_pure_def("_bottom_", {"type": "bottom", "const_type": const_type})
 
 
 class ThorinCmp(ThorinDef):
+    __slots__ = ("op", "args")
+    operand_fields = ("args",)
+
     def __init__(self, op, args):
         super().__init__()
         self.op = op
@@ -268,15 +275,13 @@ class ThorinCmp(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_cmp_" + str(save_index)
-
-        def_table.append({"type": "cmp", "name": name, "op": op, "args": args})
-        return name
+        return module.add_pure_def("_cmp_", {"type": "cmp", "op": op, "args": args})
 
 
 class ThorinLEA(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -286,15 +291,13 @@ class ThorinLEA(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_lea_" + str(save_index)
-
-        def_table.append({"type": "lea", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_lea_", {"type": "lea", "args": args})
 
 
 class ThorinLoad(ThorinDef):
+    __slots__ = ("mem", "pointer")
+    operand_fields = ("mem", "pointer")
+
     def __init__(self, mem, pointer):
         super().__init__()
         self.mem = mem
@@ -304,15 +307,13 @@ class ThorinLoad(ThorinDef):
         mem = self.mem.get(module)
         pointer = self.pointer.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_load_" + str(save_index)
-
-        def_table.append({"type": "load", "name": name, "args": [mem, pointer]})
-        return name
+        return module.add_def("_load_", {"type": "load", "args": [mem, pointer]})
 
 
 class ThorinExtract(ThorinDef):
+    __slots__ = ("aggregate", "index")
+    operand_fields = ("aggregate", "index")
+
     def __init__(self, aggregate, index):
         super().__init__()
         self.aggregate = aggregate
@@ -328,15 +329,13 @@ class ThorinExtract(ThorinDef):
         aggregate = self.aggregate.get(module)
         index = self.index.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_extract_" + str(save_index)
-
-        def_table.append({"type": "extract", "name": name, "args": [aggregate, index]})
-        return name
+        return module.add_pure_def("_extract_", {"type": "extract", "args": [aggregate, index]})
 
 
 class ThorinInsert(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -346,15 +345,13 @@ class ThorinInsert(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_insert_" + str(save_index)
-
-        def_table.append({"type": "insert", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_insert_", {"type": "insert", "args": args})
 
 
 class ThorinCast(ThorinDef):
+    __slots__ = ("source", "type")
+    operand_fields = ("source", "type")
+
     def __init__(self, source, type):
         super().__init__()
         self.source = source
@@ -364,15 +361,13 @@ class ThorinCast(ThorinDef):
         source = self.source.get(module)
         type = self.type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_cast_" + str(save_index)
-
-        def_table.append({"type": "cast", "name": name, "source": source, "target_type": type})
-        return name
+        return module.add_pure_def("_cast_", {"type": "cast", "source": source, "target_type": type})
 
 
 class ThorinBitcast(ThorinDef):
+    __slots__ = ("source", "type")
+    operand_fields = ("source", "type")
+
     def __init__(self, source, type):
         super().__init__()
         self.source = source
@@ -382,26 +377,22 @@ class ThorinBitcast(ThorinDef):
         source = self.source.get(module)
         type = self.type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_bitcast_" + str(save_index)
-
-        def_table.append({"type": "bitcast", "name": name, "source": source, "target_type": type})
-        return name
+        return module.add_pure_def("_bitcast_", {"type": "bitcast", "source": source, "target_type": type})
 
 
 class ThorinRun(ThorinDef):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
     def compile(self, module):
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_run_" + str(save_index)
-        def_table.append({"type": "run", "name": name})
-        return name
+        return module.add_def("_run_", {"type": "run"})
 
 
 class ThorinHlt(ThorinDef):
+    __slots__ = ("target",)
+    operand_fields = ("target",)
+
     def __init__(self, target):
         super().__init__()
         self.target = target
@@ -409,15 +400,13 @@ class ThorinHlt(ThorinDef):
     def compile(self, module):
         target = self.target.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_hlt_" + str(save_index)
-
-        def_table.append({"type": "hlt", "name": name, "target": target})
-        return name
+        return module.add_def("_hlt_", {"type": "hlt", "target": target})
 
 
 class ThorinStore(ThorinDef):
+    __slots__ = ("mem", "pointer", "value")
+    operand_fields = ("mem", "pointer", "value")
+
     def __init__(self, mem, pointer, value):
         super().__init__()
         self.mem = mem
@@ -435,15 +424,13 @@ class ThorinStore(ThorinDef):
         pointer = self.pointer.get(module)
         value = self.value.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_store_" + str(save_index)
-
-        def_table.append({"type": "store", "name": name, "args": [mem, pointer, value]})
-        return name
+        return module.add_def("_store_", {"type": "store", "args": [mem, pointer, value]})
 
 
 class ThorinEnter(ThorinDef):
+    __slots__ = ("mem",)
+    operand_fields = ("mem",)
+
     def __init__(self, mem):
         super().__init__()
         self.mem = mem
@@ -451,15 +438,13 @@ class ThorinEnter(ThorinDef):
     def compile(self, module):
         mem = self.mem.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_enter_" + str(save_index)
-
-        def_table.append({"type": "enter", "name": name, "mem": mem})
-        return name
+        return module.add_def("_enter_", {"type": "enter", "mem": mem})
 
 
 class ThorinSlot(ThorinDef):
+    __slots__ = ("frame", "type")
+    operand_fields = ("type", "frame")
+
     def __init__(self, frame, type):
         super().__init__()
         self.frame = frame
@@ -469,19 +454,17 @@ class ThorinSlot(ThorinDef):
         type = self.type.get(module)
         frame = self.frame.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_slot_" + str(save_index)
-
-        def_table.append({"type": "slot", "name": name, "frame": frame, "target_type": type})
-        return name
+        return module.add_def("_slot_", {"type": "slot", "frame": frame, "target_type": type})
 
 
 class ThorinDefiniteArray(ThorinDef):
+    __slots__ = ("elem_type", "args")
+    operand_fields = ("elem_type", "args")
+
     def __init__(self, elem_type, args):
         super().__init__()
         self.elem_type = elem_type
-        self.args = args
+        self.args = list(args)
 
     def compile(self, module):
         elem_type = self.elem_type.get(module)
@@ -489,15 +472,56 @@ class ThorinDefiniteArray(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_definitearray_" + str(save_index)
+        return module.add_pure_def("_definitearray_", {"type": "def_array", "elem_type": elem_type, "args": args})
 
-        def_table.append({"type": "def_array", "name": name, "elem_type": elem_type, "args": args})
-        return name
+
+class ThorinConstantArray(ThorinDef):
+    """A definite array of constants, stored packed instead of as one ThorinConstant per element.
+
+    data is anything with the buffer protocol (bytes, bytearray, array.array, numpy arrays) that holds
+    elements of elem_type, or a sequence of Python numbers. The data is copied."""
+    __slots__ = ("elem_type", "data", "format")
+    operand_fields = ("elem_type",)
+
+    def __init__(self, elem_type, data):
+        super().__init__()
+        elem_ctype = prim_ctypes[prim_kind(elem_type.tag)]
+        self.elem_type = elem_type
+        self.format = elem_ctype._type_
+
+        if isinstance(data, (list, tuple, range)):
+            self.data = bytes((elem_ctype * len(data))(*data))
+        else:
+            view = memoryview(data)
+            check_buffer_format(view, elem_type)
+            self.data = view.tobytes()
+
+    def __len__(self):
+        return len(self.data) // struct.calcsize(self.format)
+
+    def values(self):
+        return memoryview(self.data).cast(self.format).tolist()
+
+    def compile(self, module):
+        elem_type = self.elem_type.get(module)
+
+        #The element constants are emitted right here, each distinct value once.
+        constants = {}
+        args = []
+        for value in self.values():
+            key = value.hex() if isinstance(value, float) else value
+            name = constants.get(key)
+            if name is None:
+                name = constants[key] = module.add_pure_def("_constant_", {"type": "const", "const_type": elem_type, "value": value})
+            args.append(name)
+
+        return module.add_pure_def("_definitearray_", {"type": "def_array", "elem_type": elem_type, "args": args})
 
 
 class ThorinIndefiniteArray(ThorinDef):
+    __slots__ = ("elem_type", "dim")
+    operand_fields = ("elem_type", "dim")
+
     def __init__(self, elem_type, dim):
         super().__init__()
         self.elem_type = elem_type
@@ -507,15 +531,13 @@ class ThorinIndefiniteArray(ThorinDef):
         elem_type = self.elem_type.get(module)
         dim = self.dim.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_indefinitearray_" + str(save_index)
-
-        def_table.append({"type": "indef_array", "name": name, "elem_type": elem_type, "dim": dim})
-        return name
+        return module.add_pure_def("_indefinitearray_", {"type": "indef_array", "elem_type": elem_type, "dim": dim})
 
 
 class ThorinGlobal(ThorinDef):
+    __slots__ = ("init", "external", "mutable")
+    operand_fields = ("init",)
+
     def __init__(self, init, mutable=False, external=None):
         super().__init__()
         self.init = init
@@ -525,20 +547,22 @@ class ThorinGlobal(ThorinDef):
     def compile(self, module):
         init = self.init.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_global_" + str(save_index)
-
-        my_def = {"type": "global", "name": name, "mutable": self.mutable, "init": init}
+        my_def = {"type": "global", "mutable": self.mutable, "init": init}
 
         if self.external is not None:
             my_def.update({"external": self.external})
+            return module.add_def("_global_", my_def)
+        if self.mutable:
+            return module.add_def("_global_", my_def)
 
-        def_table.append(my_def)
-        return name
+        #Immutable internal globals with the same initializer (string literals, tables) are pooled.
+        return module.add_pure_def("_global_", my_def)
 
 
 class ThorinClosure(ThorinDef):
+    __slots__ = ("args", "closure_type")
+    operand_fields = ("closure_type", "args")
+
     def __init__(self, args, closure_type):
         super().__init__()
         self.args = args
@@ -550,15 +574,13 @@ class ThorinClosure(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_closure_" + str(save_index)
-
-        def_table.append({"type": "closure", "name": name, "closure_type": closure_type, "args": args})
-        return name
+        return module.add_pure_def("_closure_", {"type": "closure", "closure_type": closure_type, "args": args})
 
 
 class ThorinStruct(ThorinDef):
+    __slots__ = ("args", "struct_type")
+    operand_fields = ("struct_type", "args")
+
     def __init__(self, struct_type, args):
         super().__init__()
         self.args = args
@@ -570,15 +592,13 @@ class ThorinStruct(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_struct_" + str(save_index)
-
-        def_table.append({"type": "struct", "name": name, "struct_type": struct_type, "args": args})
-        return name
+        return module.add_pure_def("_struct_", {"type": "struct", "struct_type": struct_type, "args": args})
 
 
 class ThorinTuple(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -588,15 +608,13 @@ class ThorinTuple(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_tuple_" + str(save_index)
-
-        def_table.append({"type": "tuple", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_tuple_", {"type": "tuple", "args": args})
 
 
 class ThorinVector(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -606,15 +624,13 @@ class ThorinVector(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_vector_" + str(save_index)
-
-        def_table.append({"type": "vector", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_vector_", {"type": "vector", "args": args})
 
 
 class ThorinAlloc(ThorinDef):
+    __slots__ = ("target_type", "args")
+    operand_fields = ("target_type", "args")
+
     def __init__(self, target_type, args):
         super().__init__()
         self.target_type = target_type
@@ -626,15 +642,13 @@ class ThorinAlloc(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_alloc_" + str(save_index)
-
-        def_table.append({"type": "alloc", "name": name, "target_type": target_type, "args": args})
-        return name
+        return module.add_def("_alloc_", {"type": "alloc", "target_type": target_type, "args": args})
 
 
 class ThorinKnown(ThorinDef):
+    __slots__ = ("int_def",)
+    operand_fields = ("int_def",)
+
     def __init__(self, int_def):
         super().__init__()
         self.int_def = int_def
@@ -642,15 +656,13 @@ class ThorinKnown(ThorinDef):
     def compile(self, module):
         int_def = self.int_def.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_known_" + str(save_index)
-
-        def_table.append({"type": "known", "name": name, "def": int_def})
-        return name
+        return module.add_pure_def("_known_", {"type": "known", "def": int_def})
 
 
 class ThorinSizeof(ThorinDef):
+    __slots__ = ("target_type",)
+    operand_fields = ("target_type",)
+
     def __init__(self, target_type):
         super().__init__()
         self.target_type = target_type
@@ -658,15 +670,13 @@ class ThorinSizeof(ThorinDef):
     def compile(self, module):
         target_type = self.target_type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_sizeof_" + str(save_index)
-
-        def_table.append({"type": "sizeof", "name": name, "target_type": target_type})
-        return name
+        return module.add_pure_def("_sizeof_", {"type": "sizeof", "target_type": target_type})
 
 
 class ThorinAlignof(ThorinDef):
+    __slots__ = ("target_type",)
+    operand_fields = ("target_type",)
+
     def __init__(self, target_type):
         super().__init__()
         self.target_type = target_type
@@ -674,15 +684,13 @@ class ThorinAlignof(ThorinDef):
     def compile(self, module):
         target_type = self.target_type.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_alignof_" + str(save_index)
-
-        def_table.append({"type": "alignof", "name": name, "target_type": target_type})
-        return name
+        return module.add_pure_def("_alignof_", {"type": "alignof", "target_type": target_type})
 
 
 class ThorinSelect(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -692,15 +700,13 @@ class ThorinSelect(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_select_" + str(save_index)
-
-        def_table.append({"type": "select", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_select_", {"type": "select", "args": args})
 
 
 class ThorinFilter(ThorinDef):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -710,15 +716,13 @@ class ThorinFilter(ThorinDef):
         for arg in self.args:
             args.append(arg.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_filter_" + str(save_index)
-
-        def_table.append({"type": "filter", "name": name, "args": args})
-        return name
+        return module.add_pure_def("_filter_", {"type": "filter", "args": args})
 
 
 class ThorinVariant(ThorinDef):
+    __slots__ = ("variant_type", "value", "index")
+    operand_fields = ("variant_type", "value")
+
     def __init__(self, variant_type, value, index):
         super().__init__()
         self.variant_type = variant_type
@@ -730,15 +734,13 @@ class ThorinVariant(ThorinDef):
         value = self.value.get(module)
         index = self.index
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_variant_" + str(save_index)
-
-        def_table.append({"type": "variant", "name": name, "variant_type": variant_type, "value": value, "index": index})
-        return name
+        return module.add_pure_def("_variant_", {"type": "variant", "variant_type": variant_type, "value": value, "index": index})
 
 
 class ThorinVariantExtract(ThorinDef):
+    __slots__ = ("value", "index")
+    operand_fields = ("value",)
+
     def __init__(self, value, index):
         super().__init__()
         self.value = value
@@ -748,15 +750,13 @@ class ThorinVariantExtract(ThorinDef):
         value = self.value.get(module)
         index = self.index
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_variantextract_" + str(save_index)
-
-        def_table.append({"type": "variantextract", "name": name, "value": value, "index": index})
-        return name
+        return module.add_pure_def("_variantextract_", {"type": "variantextract", "value": value, "index": index})
 
 
 class ThorinVariantIndex(ThorinDef):
+    __slots__ = ("value",)
+    operand_fields = ("value",)
+
     def __init__(self, value):
         super().__init__()
         self.value = value
@@ -764,15 +764,13 @@ class ThorinVariantIndex(ThorinDef):
     def compile(self, module):
         value = self.value.get(module)
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_variantindex_" + str(save_index)
-
-        def_table.append({"type": "variantindex", "name": name, "value": value})
-        return name
+        return module.add_pure_def("_variantindex_", {"type": "variantindex", "value": value})
 
 
 class ThorinAssembly(ThorinDef):
+    __slots__ = ("asm_type", "inputs", "asm_template", "in_constraints", "out_constraints", "clobbers")
+    operand_fields = ("asm_type", "inputs")
+
     def __init__(self, asm_type, inputs, asm_template, in_constraints, out_constraints, clobbers):
         super().__init__()
         self.asm_type = asm_type
@@ -788,15 +786,158 @@ class ThorinAssembly(ThorinDef):
         for i in self.inputs:
             inputs.append(i.get(module))
 
-        def_table = module["defs"]
-        save_index = len(def_table)
-        name = "_assembly_" + str(save_index)
-
-        def_table.append({"type": "assembly", "name": name, "asm_type": asm_type, "inputs": inputs, "asm_template": self.asm_template, "input_constraints": self.in_constraints, "output_constraints": self.out_constraints, "clobbers": self.clobbers})
-        return name
+        return module.add_def("_assembly_", {"type": "assembly", "asm_type": asm_type, "inputs": inputs, "asm_template": self.asm_template, "input_constraints": self.in_constraints, "output_constraints": self.out_constraints, "clobbers": self.clobbers})
 
 #Helper functions that construct common complex patterns
 
+def thorinOperand(value, other=None):
+    """Turns a Python literal into a constant. Next to another operand, the literal takes on the prim type
+    of that operand: x + 1 for a qf64 x adds a qf64 1.0. Without one, ints become qs32 constants."""
+    if isinstance(value, (int, float)):
+        other_type = thorinTypeOf(other) if isinstance(other, ThorinDef) else None
+        if isinstance(other_type, ThorinPrimType) and other_type.length == 1:
+            return thorinLiteral(value, other_type)
+    if isinstance(value, int):
+        int_type = ThorinPrimType("qs32")
+        return ThorinConstant(int_type, value)
+    return value
+
+def thorinLiteral(value, prim_type):
+    tag = prim_type.tag
+    if tag == "bool" or isinstance(value, bool):
+        if tag != "bool" or not isinstance(value, bool):
+            raise TypeError("can't use the literal %r with an operand of type %s" % (value, tag))
+        return ThorinConstant(prim_type, value)
+    if tag[1] != "f" and isinstance(value, float):
+        raise TypeError("can't use the float literal %r with an operand of type %s" % (value, tag))
+    return ThorinConstant(prim_type, thorinWrapValue(prim_type, value))
+
+def thorinPrimConstant(value):
+    """The ThorinPrimType and value of a scalar constant, None for anything else."""
+    if isinstance(value, ThorinConstant) and isinstance(value.type, ThorinPrimType) and value.type.length == 1:
+        return value.type, value.value
+    return None
+
+def thorinWrapValue(prim_type, value):
+    """Brings a folded value into the range of prim_type, with the wrap-around of the target."""
+    tag = prim_type.tag
+    if tag == "bool":
+        return bool(value)
+    kind, width = tag[1], int(tag[2:])
+    if kind == "f":
+        value = float(value)
+        if width == 32:
+            return struct.unpack("f", struct.pack("f", value))[0]
+        if width == 16:
+            return struct.unpack("e", struct.pack("e", value))[0]
+        return value
+    value = value % (1 << width)
+    if kind == "s" and value >= 1 << (width - 1):
+        value -= 1 << width
+    return value
+
+def thorinFoldArith(op, lhs, rhs):
+    lhs_type, lhs_value = lhs
+    rhs_type, rhs_value = rhs
+    if lhs_type.tag != rhs_type.tag or lhs_type.tag == "bool":
+        return None
+
+    if lhs_type.tag[1] == "f":
+        if op == "div" and rhs_value == 0:
+            return None
+        value = {"add": operator.add, "sub": operator.sub, "mul": operator.mul, "div": operator.truediv}[op](lhs_value, rhs_value)
+    else:
+        if op == "div":
+            if rhs_value == 0:
+                return None
+            #C semantics: round towards zero.
+            value = abs(lhs_value) // abs(rhs_value)
+            if (lhs_value < 0) != (rhs_value < 0):
+                value = -value
+        else:
+            value = {"add": operator.add, "sub": operator.sub, "mul": operator.mul}[op](lhs_value, rhs_value)
+
+    return ThorinConstant(lhs_type, thorinWrapValue(lhs_type, value))
+
+def thorinSamePrimType(value_type, prim_type):
+    return isinstance(value_type, ThorinPrimType) and value_type.tag == prim_type.tag and value_type.length == prim_type.length
+
+def thorinArithIdentity(op, other, const, const_is_rhs):
+    """other op const (or const op other) if that is just other or a constant, None otherwise."""
+    const_type, value = const
+    if const_type.tag == "bool":
+        return None
+    is_float = const_type.tag[1] == "f"
+    if op == "mul" and value == 0 and not is_float:
+        #Floats have to keep NaN, infinity and the sign of zero.
+        return ThorinConstant(const_type, 0)
+    if op == "mul" and value == 1:
+        return other
+    if op == "div" and value == 1 and const_is_rhs:
+        return other
+    if is_float:
+        #x + 0.0 turns -0.0 into 0.0, only x + (-0.0) and x - 0.0 leave every x as it is.
+        negative_zero = value == 0 and math.copysign(1.0, value) < 0
+        if op == "add" and negative_zero:
+            return other
+        if op == "sub" and value == 0 and not negative_zero and const_is_rhs:
+            return other
+    elif value == 0 and (op == "add" or (op == "sub" and const_is_rhs)):
+        return other
+    return None
+
+def thorinArithOp(op, lhs, rhs):
+    """Builds lhs op rhs, folding constant operands and trivial identities at trace time."""
+    lhs = thorinOperand(lhs, rhs)
+    rhs = thorinOperand(rhs, lhs)
+
+    lhs_const = thorinPrimConstant(lhs)
+    rhs_const = thorinPrimConstant(rhs)
+    if lhs_const is not None and rhs_const is not None:
+        folded = thorinFoldArith(op, lhs_const, rhs_const)
+        if folded is not None:
+            return folded
+
+    #The identities below return the other operand, they only hold if both operands have the same type.
+    #thorinTypeOf is constant time here, operands that are ops carry their type.
+    if rhs_const is not None and thorinSamePrimType(thorinTypeOf(lhs), rhs_const[0]):
+        identity = thorinArithIdentity(op, lhs, rhs_const, True)
+        if identity is not None:
+            return identity
+    if lhs_const is not None and thorinSamePrimType(thorinTypeOf(rhs), lhs_const[0]):
+        identity = thorinArithIdentity(op, rhs, lhs_const, False)
+        if identity is not None:
+            return identity
+
+    return ThorinArithOp(op, [lhs, rhs])
+
+def thorinCmp(op, lhs, rhs):
+    """Builds the comparison lhs op rhs, folding it to a bool constant if both operands are constants."""
+    lhs = thorinOperand(lhs, rhs)
+    rhs = thorinOperand(rhs, lhs)
+
+    lhs_const = thorinPrimConstant(lhs)
+    rhs_const = thorinPrimConstant(rhs)
+    if lhs_const is not None and rhs_const is not None and lhs_const[0].tag == rhs_const[0].tag:
+        compare = {"lt": operator.lt, "le": operator.le, "gt": operator.gt, "ge": operator.ge, "eq": operator.eq, "ne": operator.ne}[op]
+        return ThorinConstant(ThorinPrimType("bool"), compare(lhs_const[1], rhs_const[1]))
+
+    return ThorinCmp(op, [lhs, rhs])
+
+def thorinTypeOf(value):
+    """The type of a def where it follows from the def itself, None if it would need a full type inference.
+    Constant time apart from chains of selects, arithmetic ops keep their type from when they were built."""
+    #A select has the type of its operands, a loop rather than recursion for nested ones.
+    while isinstance(value, ThorinSelect):
+        value = value.args[1]
+    if isinstance(value, (ThorinConstant, ThorinContinuation, ThorinTop, ThorinBottom, ThorinCast, ThorinBitcast, ThorinArithOp, ThorinMathOp)):
+        return value.type
+    if isinstance(value, ThorinParameter):
+        return value.parent.type.args[value.index]
+    if isinstance(value, ThorinCmp):
+        return ThorinPrimType("bool")
+    return None
+
 def thorinLoadExtract(mem, ptr):
     load = ThorinLoad(mem, ptr)
     return (ThorinExtract(load, 0), ThorinExtract(load, 1))
@@ -805,6 +946,17 @@ def thorinEnterExtract(mem):
     res = ThorinEnter(mem)
     return (ThorinExtract(res, 0), ThorinExtract(res, 1))
 
+def thorinIntrinsic(intrinsic, fn_type):
+    """A declaration of intrinsic with fn_type. Declarations of the same (intrinsic, fn type) pair are
+    emitted only once per module, see ThorinWorld.intrinsics."""
+    return ThorinContinuation(fn_type, intrinsic=intrinsic)
+
+def thorinBranchType():
+    mem_type = ThorinMemType()
+    mem_fn_type = ThorinFnType([mem_type])
+    bool_type = ThorinPrimType("bool")
+    return ThorinFnType([mem_type, bool_type, mem_fn_type, mem_fn_type])
+
 def thorinBranch(target, mem_param, cond_param, branch_true=None, branch_false=None):
     if branch_true is None or branch_false is None:
         mem_type = ThorinMemType()
@@ -815,9 +967,7 @@ def thorinBranch(target, mem_param, cond_param, branch_true=None, branch_false=N
     if branch_false is None:
         branch_false = ThorinContinuation(mem_fn_type)
 
-    bool_type = ThorinPrimType("bool")
-    branch_type = ThorinFnType([mem_type, bool_type, mem_fn_type, mem_fn_type])
-    branch_int = ThorinContinuation(branch_type, intrinsic="branch")
+    branch_int = thorinIntrinsic("branch", thorinBranchType())
     target(branch_int, mem_param, cond_param, branch_true, branch_false)
 
     return branch_true, branch_true.parameters[0], branch_false, branch_false.parameters[0]
@@ -834,40 +984,171 @@ def thorinBranchFn(mem_param, cond_param, branch_true=None, branch_false=None):
         if branch_false is not None:
             branch_false(branch_false_block, branch_false_mem)
 
-    bool_type = ThorinPrimType("bool")
-    branch_type = ThorinFnType([mem_type, bool_type, mem_fn_type, mem_fn_type])
-    branch_int = ThorinContinuation(branch_type, intrinsic="branch")
+    branch_int = thorinIntrinsic("branch", thorinBranchType())
 
     return (branch_int, mem_param, cond_param, branch_true_block, branch_false_block)
 
 def thorinString(content):
-    strlen = len(content)
-    bytestr = list(content.encode("utf-8")) + [0]
+    bytestr = content.encode("utf-8") + b"\0"
 
     u8type = ThorinPrimType("pu8")
 
-    def_array = ThorinDefiniteArray(u8type, map(lambda x: ThorinConstant(u8type, x), bytestr))
+    def_array = ThorinConstantArray(u8type, bytestr)
     global_array = ThorinGlobal(def_array)
     bitcast_array = ThorinBitcast(global_array, ThorinPointerType(ThorinIndefiniteArrayType(u8type)))
 
     return bitcast_array
 
-def thorinRangeFn(mem_param, lower, upper, step, body_fn, return_fn):
+def thorinRangeFn(mem_param, lower, upper, step, body_fn, return_fn, unroll=1, tile=None, values=None, value_types=None):
+    """A loop from lower to upper (exclusive) with a positive step. body_fn(block, mem, i, next_fn) is traced for
+    the body, return_fn(block, mem) for the exit. Returns the application that enters the loop.
+
+    values are loop-carried: they start out as given, the body gets their current state as
+    body_fn(block, mem, i, next_fn, *values) and passes the new state on as next_fn(mem, *values),
+    return_fn(block, mem, *values) gets the final state. Their types are taken from the initial values
+    unless value_types is given.
+
+    unroll=N traces N copies of the body per iteration, the remaining iterations run in a loop of their own
+    (or unrolled, if the trip count is known). With N > 1, loops with constant bounds and at most N iterations are
+    unrolled completely. tile=T strip-mines the loop into tiles of T iterations, unroll then applies
+    to the loop over a tile."""
+    values = [thorinOperand(value) for value in values] if values is not None else []
+    if value_types is None:
+        value_types = [thorinTypeOf(value) for value in values]
+        if None in value_types:
+            raise TypeError("can't infer the type of a loop-carried value, pass value_types")
+
+    trip_count = None
+    if isinstance(lower, int) and isinstance(upper, int) and isinstance(step, int):
+        trip_count = len(range(lower, upper, step))
+
+    if tile is not None and tile > 1:
+        return thorinTiledRange(mem_param, lower, upper, step, body_fn, return_fn, unroll, tile, trip_count, values, value_types)
+    return thorinRangeLoop(mem_param, lower, upper, step, body_fn, return_fn, unroll, trip_count, values, value_types)
+
+def thorinRangeIndex(i, step, k):
+    """i + k * step, folded where possible."""
+    if isinstance(i, int) and isinstance(step, int):
+        return i + k * step
+    return thorinArithOp("add", i, thorinArithOp("mul", step, k))
+
+def thorinUnrolledRange(mem_param, indices, body_fn, exit_block, values, value_types):
+    """Traces body_fn once per index, chained one after the other and then jumping to exit_block."""
+    mem_type = ThorinMemType()
+    block_type = ThorinFnType([mem_type, *value_types])
+
+    blocks = [ThorinContinuation(block_type) for i in indices]
+    for k, i in enumerate(indices):
+        next_block = blocks[k + 1] if k + 1 < len(blocks) else exit_block
+        with blocks[k] as (block, block_mem, *block_values):
+            body_fn(block, block_mem, thorinOperand(i), next_block, *block_values)
+
+    if not blocks:
+        return (exit_block, mem_param, *values)
+    return (blocks[0], mem_param, *values)
+
+def thorinRangeLoop(mem_param, lower, upper, step, body_fn, return_fn, unroll, trip_count, values=(), value_types=()):
+    int_type = ThorinPrimType("qs32")
+    mem_type = ThorinMemType()
+    mem_fn_type = ThorinFnType([mem_type])
+    #Continuation that receives the loop-carried values, just fn(mem) without any.
+    next_fn_type = ThorinFnType([mem_type, *value_types])
+
+    #Only unroll completely when asked to, the default keeps constant loops of 0 or 1 iterations a loop.
+    if unroll > 1 and trip_count is not None and trip_count <= unroll:
+        with ThorinContinuation(next_fn_type) as (return_block, return_mem, *return_values):
+            return_fn(return_block, return_mem, *return_values)
+        return thorinUnrolledRange(mem_param, [thorinRangeIndex(lower, step, k) for k in range(trip_count)], body_fn, return_block, values, value_types)
+
+    lower = thorinOperand(lower)
+    upper = thorinOperand(upper)
+    step = thorinOperand(step)
+
+    body_fn_type = ThorinFnType([mem_type, int_type, next_fn_type, *value_types])
+    range_fn_type = ThorinFnType([mem_type, int_type, int_type, *value_types])
+
+    if unroll <= 1:
+        with ThorinContinuation(body_fn_type) as (body_block, body_mem, i, next_fn, *body_values):
+            body_fn(body_block, body_mem, i, next_fn, *body_values)
+
+    with ThorinContinuation(next_fn_type) as (return_block, return_mem, *return_values):
+        return_fn(return_block, return_mem, *return_values)
+
+    with ThorinContinuation(range_fn_type) as (range_fn, range_mem, lower_param, upper_param, *range_values):
+        def branch_true(branch_true, true_mem): #Loop Body
+            with ThorinContinuation(next_fn_type) as (continue_fn, continue_mem, *continue_values):
+                next_lower = lower_param + thorinArithOp("mul", step, max(unroll, 1))
+                continue_fn(range_fn, continue_mem, next_lower, upper_param, *continue_values)
+
+            if unroll <= 1:
+                branch_true(body_block, true_mem, lower_param, continue_fn, *range_values)
+            else:
+                indices = [thorinRangeIndex(lower_param, step, k) for k in range(unroll)]
+                branch_true(*thorinUnrolledRange(true_mem, indices, body_fn, continue_fn, range_values, value_types))
+
+        def branch_false(branch_false, false_mem): #Loop Exit
+            if unroll <= 1:
+                branch_false(return_block, false_mem, *range_values)
+            elif trip_count is not None:
+                #The loop exits with lower_param at the first of the remaining iterations.
+                indices = [thorinRangeIndex(lower_param, step, k) for k in range(trip_count % unroll)]
+                branch_false(*thorinUnrolledRange(false_mem, indices, body_fn, return_block, range_values, value_types))
+            else:
+                exit_fn = lambda block, mem, *exit_values: block(return_block, mem, *exit_values)
+                branch_false(*thorinRangeLoop(false_mem, lower_param, upper_param, step, body_fn, exit_fn, 1, None, range_values, value_types))
+
+        if unroll <= 1:
+            condition = lower_param < upper_param
+        else:
+            #Only enter the unrolled body if all of its iterations are in range.
+            condition = thorinArithOp("add", lower_param, thorinArithOp("mul", step, unroll - 1)) < upper_param
+        range_fn(*thorinBranchFn(range_mem, condition, branch_true, branch_false))
+
+    return (range_fn, mem_param, lower, upper, *values)
+
+def thorinTiledRange(mem_param, lower, upper, step, body_fn, return_fn, unroll, tile, trip_count, values, value_types):
+    tile_step = step * tile if isinstance(step, int) else thorinArithOp("mul", step, tile)
+
+    tile_trip_count = None
+    tile_count = None
+    if trip_count is not None:
+        tile_count = (trip_count + tile - 1) // tile
+        if trip_count % tile == 0:
+            tile_trip_count = tile
+
+    def tile_body(block, mem, tile_lower, next_tile, *tile_values):
+        tile_upper = thorinArithOp("add", tile_lower, tile_step)
+        if tile_trip_count is None:
+            #The last tile may be cut short.
+            upper_def = thorinOperand(upper)
+            tile_upper = ThorinSelect([tile_upper < upper_def, tile_upper, upper_def])
+        exit_fn = lambda inner, inner_mem, *inner_values: inner(next_tile, inner_mem, *inner_values)
+        block(*thorinRangeLoop(mem, tile_lower, tile_upper, step, body_fn, exit_fn, unroll, tile_trip_count, list(tile_values), value_types))
+
+    return thorinRangeLoop(mem_param, lower, upper, tile_step, tile_body, return_fn, 1, tile_count, values, value_types)
+
+def thorinReduceFn(mem_param, lower, upper, step, init, reduce_fn, return_fn, unroll=1, tile=None, value_type=None):
+    """Folds the range into a value kept in a loop-carried parameter: reduce_fn(mem, i, value) returns the
+    (mem, value) after iteration i, return_fn(block, mem, value) gets the result."""
+    def body(block, mem, i, next_fn, value):
+        block(next_fn, *reduce_fn(mem, i, value))
+
+    value_types = [value_type] if value_type is not None else None
+    return thorinRangeFn(mem_param, lower, upper, step, body, return_fn, unroll, tile, [init], value_types)
+
+def thorinParallelFn(mem_param, num_threads, lower, upper, body_fn, return_fn):
+    """Like thorinRangeFn, but the iterations are spread over num_threads threads by the runtime (0 picks a default).
+    body_fn(block, mem, i, next_fn) may run concurrently for different i."""
     int_type = ThorinPrimType("qs32")
     mem_type = ThorinMemType()
 
-    if isinstance(lower, int):
-        lower = ThorinConstant(int_type, lower)
-    if isinstance(upper, int):
-        upper = ThorinConstant(int_type, upper)
-    if isinstance(step, int):
-        step = ThorinConstant(int_type, step)
+    num_threads = thorinOperand(num_threads)
+    lower = thorinOperand(lower)
+    upper = thorinOperand(upper)
 
-    ret_fn_type = ThorinFnType([mem_type, int_type])
-    export_fn_type = ThorinFnType([mem_type, int_type, int_type, ret_fn_type])
     mem_fn_type = ThorinFnType([mem_type])
     body_fn_type = ThorinFnType([mem_type, int_type, mem_fn_type])
-    range_fn_type = ThorinFnType([mem_type, int_type, int_type])
+    parallel_type = ThorinFnType([mem_type, int_type, int_type, int_type, body_fn_type, mem_fn_type])
 
     with ThorinContinuation(body_fn_type) as (body_block, body_mem, i, next_fn):
         body_fn(body_block, body_mem, i, next_fn)
@@ -875,17 +1156,27 @@ def thorinRangeFn(mem_param, lower, upper, step, body_fn, return_fn):
     with ThorinContinuation(mem_fn_type) as (return_block, return_mem):
         return_fn(return_block, return_mem)
 
-    with ThorinContinuation(range_fn_type) as (range_fn, range_mem, lower_param, upper_param):
-        def branch_true(branch_true, true_mem): #Loop Body
-            with ThorinContinuation(mem_fn_type) as (continue_fn, continue_mem):
-                next_lower = lower_param + step
-                continue_fn(range_fn, continue_mem, next_lower, upper_param)
+    parallel_int = thorinIntrinsic("parallel", parallel_type)
 
-            branch_true(body_block, true_mem, lower_param, continue_fn)
+    return (parallel_int, mem_param, num_threads, lower, upper, body_block, return_block)
 
-        def branch_false(branch_false, false_mem): #Loop Exit
-            branch_false(return_block, false_mem)
+def thorinVectorizeFn(mem_param, vector_length, body_fn, return_fn):
+    """Runs body_fn(block, mem, lane, next_fn) for the lanes 0 to vector_length - 1 as one SIMD instance."""
+    int_type = ThorinPrimType("qs32")
+    mem_type = ThorinMemType()
+
+    vector_length = thorinOperand(vector_length)
+
+    mem_fn_type = ThorinFnType([mem_type])
+    body_fn_type = ThorinFnType([mem_type, int_type, mem_fn_type])
+    vectorize_type = ThorinFnType([mem_type, int_type, body_fn_type, mem_fn_type])
+
+    with ThorinContinuation(body_fn_type) as (body_block, body_mem, lane, next_fn):
+        body_fn(body_block, body_mem, lane, next_fn)
+
+    with ThorinContinuation(mem_fn_type) as (return_block, return_mem):
+        return_fn(return_block, return_mem)
 
-        range_fn(*thorinBranchFn(range_mem, lower_param < upper_param, branch_true, branch_false))
+    vectorize_int = thorinIntrinsic("vectorize", vectorize_type)
 
-    return (range_fn, mem_param, lower, upper)
+    return (vectorize_int, mem_param, vector_length, body_block, return_block)
@@ -0,0 +1,78 @@
+import hashlib
+import marshal
+import re
+
+from .type_table import *
+from .thorin import Thorin
+
+numpy_kinds = {"i": "s", "u": "u", "f": "f"}
+
+def jit_arg_tag(value):
+    """The prim type tag a call argument gets traced with: bool, int as qs32, float as qf64,
+    NumPy scalars according to their dtype."""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "qs32"
+    if isinstance(value, float):
+        return "qf64"
+
+    dtype = getattr(value, "dtype", None)
+    if dtype is not None and getattr(value, "ndim", None) == 0:
+        if dtype.kind == "b":
+            return "bool"
+        kind = numpy_kinds.get(dtype.kind)
+        if kind is not None:
+            return "q%s%d" % (kind, dtype.itemsize * 8)
+
+    raise TypeError("can't pass %s to a jit compiled function" % type(value).__name__)
+
+
+def jit_symbol_name(function):
+    """A symbol name for function that is stable across processes: its qualified name with everything but
+    letters, digits and underscores replaced, and a short hash of its module, name and code object to keep
+    functions of the same name (lambdas, closures, methods in different modules) apart."""
+    qualname = getattr(function, "__qualname__", function.__name__)
+    digest = hashlib.sha256()
+    digest.update(("%s:%s:" % (function.__module__, qualname)).encode("utf-8"))
+    digest.update(marshal.dumps(function.__code__))
+    return "%s_%s" % (re.sub(r"[^0-9A-Za-z_]", "_", qualname), digest.hexdigest()[:12])
+
+
+class ThorinJitFunction:
+    """A Python function that is traced and compiled once per signature of its arguments.
+
+    Every specialization is its own module. Compiled libraries go through the build cache (cache_dir or
+    THORIN_CACHE_DIR), so a later process only traces the function again but skips anyopt and clang."""
+    def __init__(self, function, cache_dir=None, build_dir=True):
+        self.function = function
+        self.symbol_name = jit_symbol_name(function)
+        self.cache_dir = cache_dir
+        self.build_dir = build_dir
+        self.specializations = {}
+
+    def __call__(self, *args):
+        signature = tuple([jit_arg_tag(arg) for arg in args])
+        function = self.specializations.get(signature)
+        if function is None:
+            function = self.specialize(signature)
+        return function(*args)
+
+    def specialize(self, signature):
+        name = "%s_%s" % (self.symbol_name, "_".join(signature))
+        #The module name ends up in the json and with it in the build cache key, keep it stable across processes.
+        thorin = Thorin("jit_" + name, module=True, cache_dir=self.cache_dir, build_dir=self.build_dir)
+        with thorin:
+            thorin.compile_function_jit(name, self.function, None, [ThorinPrimType(tag) for tag in signature])
+
+        #ctypes never unloads a library, the Thorin object can go (and clean up after itself).
+        function = thorin.get_function(name)
+        self.specializations[signature] = function
+        return function
+
+
+def thorinJit(function=None, cache_dir=None, build_dir=True):
+    """Decorator, usable as @thorinJit or @thorinJit(cache_dir=...)."""
+    if function is None:
+        return lambda function: ThorinJitFunction(function, cache_dir, build_dir)
+    return ThorinJitFunction(function, cache_dir, build_dir)
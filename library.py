@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+from .type_table import *
+from .irbuilder import *
+from .build_cache import tool_identity
+
+#Bump whenever the cached form of an included module changes, so stale cache entries are not picked up.
+library_format = 2
+
+#Libraries already loaded by this process, keyed on (path, mtime, size) of the included file and the import mode.
+loaded_libraries = {}
+
+
+class ThorinLibrary:
+    """The definitions of an included module, reconstructed from its json.
+
+    A lazy library only indexes the module up front and reconstructs a definition, together with the types
+    it needs, the first time find() asks for it."""
+    def __init__(self, extern_module, lazy=False):
+        self.type_table = {}
+        self.definitions = {}
+        self.lazy = lazy
+
+        if lazy:
+            self.extern_module = extern_module
+            self.type_index = {}
+            for offset, extern_type in enumerate(extern_module["type_table"]):
+                self.type_index.setdefault(extern_type["name"], []).append(offset)
+            self.def_index = {}
+            for offset, definition in enumerate(extern_module["defs"]):
+                if "internal" in definition:
+                    self.def_index[definition["internal"]] = offset
+            return
+
+        for extern_type in extern_module["type_table"]:
+            self.type_table.update(ThorinType.import_type(extern_type, self.type_table))
+
+        for definition in extern_module["defs"]:
+            if "internal" in definition:
+                imported_type = self.type_table[definition["fn_type"]]
+
+                imported_def = ThorinContinuation(imported_type, internal=definition["internal"]) # XXX: These continuations can only be used in a specific order with the imported files!
+                self.definitions.update({definition["internal"]: imported_def})
+
+    def find(self, name):
+        """The imported continuation called name, None if the module doesn't define it."""
+        imported_def = self.definitions.get(name)
+        if imported_def is None and self.lazy:
+            offset = self.def_index.get(name)
+            if offset is None:
+                return None
+            definition = self.extern_module["defs"][offset]
+            imported_type = self.import_type(definition["fn_type"])
+
+            imported_def = ThorinContinuation(imported_type, internal=name) # XXX: These continuations can only be used in a specific order with the imported files!
+            self.definitions.update({name: imported_def})
+        return imported_def
+
+    def import_type(self, name):
+        imported_type = self.type_table.get(name)
+        if imported_type is not None:
+            return imported_type
+
+        entries = [self.extern_module["type_table"][offset] for offset in self.type_index[name]]
+        if len(entries) == 2:
+            #Nominal types come as a declaration followed by the definition, declaring first breaks cycles.
+            declaration, definition = entries
+            self.type_table.update(ThorinType.import_type(declaration, self.type_table))
+            for arg in definition["args"]:
+                self.import_type(arg)
+            ThorinType.import_type(definition, self.type_table)
+        else:
+            for arg in entries[0].get("args", []):
+                self.import_type(arg)
+            self.type_table.update(ThorinType.import_type(entries[0], self.type_table))
+        return self.type_table[name]
+
+    @staticmethod
+    def load(module_file, build_cache=None, lazy=False):
+        """Loads an .art or .thorin.json file. Repeated loads of an unchanged file return the same library;
+        with a build cache, the artic output and the parts of the module a library needs are also kept on disk."""
+        stat = os.stat(module_file)
+        stamp = (os.path.realpath(module_file), stat.st_mtime_ns, stat.st_size, lazy)
+
+        library = loaded_libraries.get(stamp)
+        if library is None:
+            if module_file.endswith(".art"):
+                module_file = compile_artic(module_file, build_cache)
+            library = read_library(module_file, build_cache, lazy)
+            loaded_libraries[stamp] = library
+        return library
+
+
+def compile_artic(art_file, build_cache=None):
+    if build_cache is None:
+        subprocess.run(["artic", "--emit-json", "-o", art_file[:-4], art_file], check=True)
+        #TODO: Mark these files for deletion if not required.
+        return art_file[:-4] + ".thorin.json"
+
+    with open(art_file, "rb") as f:
+        source = f.read()
+    key = hashlib.sha256(tool_identity("artic").encode("utf-8") + b"\0" + source).hexdigest()
+
+    module_file = build_cache.lookup(key, ".thorin.json")
+    if module_file is None:
+        with tempfile.TemporaryDirectory(dir=build_cache.cache_dir) as build_dir:
+            output = os.path.join(build_dir, os.path.basename(art_file)[:-4])
+            subprocess.run(["artic", "--emit-json", "-o", output, art_file], check=True)
+            with open(output + ".thorin.json", "rb") as f:
+                module_file = build_cache.store_data(key, ".thorin.json", f.read())
+    return module_file
+
+
+def library_module(extern_module):
+    """The parts of a module ThorinLibrary reads: the type table and the signatures of the internal definitions."""
+    defs = [{"internal": definition["internal"], "fn_type": definition["fn_type"]} for definition in extern_module["defs"] if "internal" in definition]
+    return {"defs": defs, "type_table": extern_module["type_table"], "module": extern_module.get("module")}
+
+
+def read_library(module_file, build_cache=None, lazy=False):
+    if build_cache is None:
+        with open(module_file) as f:
+            return ThorinLibrary(json.load(f), lazy)
+
+    with open(module_file, "rb") as f:
+        module_json = f.read()
+    key = hashlib.sha256(b"library%d\0" % library_format + module_json).hexdigest()
+
+    #The cache directory may be shared, only data that can't run code is kept there: the stripped module as json.
+    cached = build_cache.lookup(key, ".library.json")
+    if cached is not None:
+        with open(cached) as f:
+            return ThorinLibrary(json.load(f), lazy)
+
+    extern_module = library_module(json.loads(module_json))
+    build_cache.store_data(key, ".library.json", json.dumps(extern_module, separators=(",", ":")).encode("utf-8"))
+    return ThorinLibrary(extern_module, lazy)
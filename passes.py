@@ -0,0 +1,200 @@
+import time
+
+from .type_table import *
+from .irbuilder import *
+
+
+class ThorinGraph:
+    """The defs reachable from a set of root continuations, in post-order, with the number of uses of each def."""
+    def __init__(self, roots):
+        self.roots = roots
+        self.nodes = []
+        self.uses = {}
+        #Rewrites a pass did in place rather than through its replace dict.
+        self.rewrites = 0
+
+        visited = set()
+        stack = [(root, False) for root in reversed(roots)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                self.nodes.append(node)
+                continue
+            if node in visited:
+                continue
+            visited.add(node)
+
+            stack.append((node, True))
+            operands = [operand for operand in [*node.operands(), *node.late_operands()] if isinstance(operand, ThorinDef)]
+            for operand in operands:
+                self.uses[operand] = self.uses.get(operand, 0) + 1
+            stack.extend([(operand, False) for operand in reversed(operands) if operand not in visited])
+
+    def apply(self, replace):
+        """Rewrites the graph according to replace (old def -> new def). Chains of replacements are followed."""
+        for old in replace:
+            new = replace[old]
+            while new in replace and replace[new] is not new:
+                new = replace[new]
+            replace[old] = new
+
+        for node in self.nodes:
+            node.replace_operands(replace)
+
+
+class ThorinPass:
+    """A graph transformation. run() returns a dict that maps defs to the defs replacing them,
+    ThorinGraph.apply() then rewrites all their uses."""
+    name = "pass"
+
+    def run(self, graph):
+        raise Exception("Not implemented")
+
+
+def constant_index(index):
+    if isinstance(index, ThorinConstant) and isinstance(index.value, int):
+        return index.value
+    return None
+
+
+class ThorinExtractForwarding(ThorinPass):
+    """extract(tuple(a, b, ...), 1) -> b, likewise for structs, vectors and insert with the same index."""
+    name = "extract-forwarding"
+
+    def run(self, graph):
+        replace = {}
+        for node in graph.nodes:
+            if not isinstance(node, ThorinExtract):
+                continue
+            index = constant_index(node.index)
+            if index is None:
+                continue
+
+            #Post-order: the aggregate might have been forwarded already.
+            aggregate = replace.get(node.aggregate, node.aggregate)
+            while isinstance(aggregate, ThorinInsert) and constant_index(aggregate.args[1]) is not None:
+                if constant_index(aggregate.args[1]) == index:
+                    replace[node] = aggregate.args[2]
+                    break
+                aggregate = aggregate.args[0]
+            else:
+                if isinstance(aggregate, (ThorinTuple, ThorinStruct, ThorinVector)) and 0 <= index < len(aggregate.args):
+                    replace[node] = aggregate.args[index]
+        return replace
+
+
+class ThorinLoadStoreForwarding(ThorinPass):
+    """A load that directly follows a store to the same pointer on the mem chain yields the stored value:
+    extract(load(store(m, p, v), p), 1) -> v and extract(load(store(m, p, v), p), 0) -> store(m, p, v)."""
+    name = "load-store-forwarding"
+
+    def run(self, graph):
+        replace = {}
+        for node in graph.nodes:
+            if not isinstance(node, ThorinExtract) or not isinstance(node.aggregate, ThorinLoad):
+                continue
+            load = node.aggregate
+            store = replace.get(load.mem, load.mem)
+            if not isinstance(store, ThorinStore) or store.pointer is not load.pointer:
+                continue
+
+            index = constant_index(node.index)
+            if index == 0:
+                replace[node] = store
+            elif index == 1:
+                replace[node] = store.value
+        return replace
+
+
+def jump_continuations(graph):
+    """Local continuations that do nothing but jump: target and args may only use their parameters directly.
+    Maps each of them to its (target, args)."""
+    jumps = {}
+    for node in graph.nodes:
+        if not isinstance(node, ThorinContinuation) or not node.app or node.filter is not None:
+            continue
+        if node.external != "" or node.internal != "" or node.intrinsic != "":
+            continue
+        target, args = node.app
+        if target is node:
+            continue
+
+        #Any other use of a parameter (an arithmetic op, a nested continuation) would end up out of scope.
+        jump_uses = {}
+        for operand in [target, *args]:
+            if isinstance(operand, ThorinParameter) and operand.parent is node:
+                jump_uses[operand] = jump_uses.get(operand, 0) + 1
+        if all(graph.uses.get(parameter, 0) == jump_uses.get(parameter, 0) for parameter in node.parameters):
+            jumps[node] = (target, args)
+    return jumps
+
+
+class ThorinJumpThreading(ThorinPass):
+    """Calls to a continuation that only jumps are redirected to its target, with its parameters
+    substituted by the arguments of the call."""
+    name = "jump-threading"
+
+    def run(self, graph):
+        jumps = jump_continuations(graph)
+        for node in graph.nodes:
+            if not isinstance(node, ThorinContinuation) or not node.app:
+                continue
+            target, args = node.app
+            seen = set()
+            #seen guards against cycles of jumps.
+            while target in jumps and target not in seen:
+                seen.add(target)
+                jump_target, jump_args = jumps[target]
+                substitute = dict(zip(target.parameters, args))
+                target = substitute.get(jump_target, jump_target)
+                args = [substitute.get(arg, arg) for arg in jump_args]
+            if seen:
+                node.app = (target, args)
+                graph.rewrites += 1
+        return {}
+
+
+class ThorinEtaReduction(ThorinPass):
+    """Replaces continuations that only pass their parameters on to another continuation by that continuation."""
+    name = "eta-reduction"
+
+    def run(self, graph):
+        replace = {}
+        for node, (target, args) in jump_continuations(graph).items():
+            #A target that is replaced itself could close a cycle of replacements.
+            if not isinstance(target, ThorinContinuation) or target in replace:
+                continue
+            if list(args) == node.parameters and len(args) == len(target.type.args):
+                replace[node] = target
+        return replace
+
+
+default_passes = [ThorinExtractForwarding(), ThorinLoadStoreForwarding(), ThorinJumpThreading(), ThorinEtaReduction()]
+
+class ThorinPassManager:
+    """Runs passes in order over the defs reachable from the given roots and records per pass
+    the wall time, the number of replaced defs and the number of reachable defs before and after."""
+    def __init__(self, passes=None):
+        if passes is None:
+            passes = default_passes
+        self.passes = passes
+        self.report = []
+
+    def run(self, roots):
+        for thorin_pass in self.passes:
+            start = time.perf_counter()
+            graph = ThorinGraph(roots)
+            nodes_before = len(graph.nodes)
+            replace = thorin_pass.run(graph)
+            graph.apply(replace)
+            elapsed = time.perf_counter() - start
+
+            nodes_after = len(ThorinGraph(roots).nodes)
+            self.report.append({"pass": thorin_pass.name, "time": elapsed, "rewrites": len(replace) + graph.rewrites, "nodes_before": nodes_before, "nodes_after": nodes_after})
+        return self.report
+
+    def format_report(self):
+        lines = []
+        for entry in self.report:
+            lines.append("%-24s %8.3f ms %6d rewrites %8d -> %d defs" % (entry["pass"], entry["time"] * 1000, entry["rewrites"], entry["nodes_before"], entry["nodes_after"]))
+        return "\n".join(lines)
@@ -0,0 +1,143 @@
+import json
+import os
+import resource
+import subprocess
+import time
+import tracemalloc
+
+
+class ThorinStage:
+    """One timed stage of a build. Sizes and other details can be added to info while it runs.
+
+    cpu is the CPU time of the thread running the stage plus that of the toolchain processes started through
+    run(), max_rss_children the peak resident set (KiB on Linux) of the largest of these processes. Both are
+    measured per process, so they stay right while other modules build in parallel. asyncio builds leave the reaping
+    of their processes to the event loop, there cpu leaves out the processes and includes what else the loop ran
+    meanwhile.
+
+    For the memory of the stage itself, max_rss_growth is how far the peak resident set of the Python process rose
+    during the stage (KiB, 0 if it stayed below an earlier peak), and with ThorinStats(memory=True) heap_peak is
+    the peak of the Python heap during the stage above its size at the start (bytes, from tracemalloc; stages
+    running in other threads at the same time are counted in). process_max_rss is the peak resident set of the
+    whole process so far, not of this stage."""
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.info = {}
+        self.children_cpu = 0.0
+        self.children_max_rss = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.max_rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.stats.memory:
+            tracemalloc.reset_peak()
+            self.heap_start = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stage = {
+            "name": self.name,
+            "start": self.start - self.stats.epoch,
+            "wall": end - self.start,
+            "cpu": time.thread_time() - self.cpu_start + self.children_cpu,
+            "max_rss_growth": max_rss - self.max_rss_start,
+            "process_max_rss": max_rss,
+        }
+        if self.stats.memory:
+            stage["heap_peak"] = max(tracemalloc.get_traced_memory()[1] - self.heap_start, 0)
+        if self.children_max_rss is not None:
+            stage["max_rss_children"] = self.children_max_rss
+        self.stats.stages.append({**stage, **self.info})
+
+    def run(self, command):
+        """subprocess.run(command, check=True), recording the resource usage of just this process."""
+        process = subprocess.Popen(command)
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        self.children_cpu += usage.ru_utime + usage.ru_stime
+        self.children_max_rss = max(self.children_max_rss or 0, usage.ru_maxrss)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+class ThorinNullStage:
+    """Stands in for ThorinStage when stats are disabled."""
+    def __init__(self):
+        self.info = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.info.clear()
+
+    def run(self, command):
+        subprocess.run(command, check=True)
+
+null_stage = ThorinNullStage()
+
+
+class ThorinStats:
+    """Time, memory and sizes of the stages of a build (trace, passes, emit, serialize, anyopt, clang, load)
+    and call counts and cumulative time of the exported functions. memory=True traces Python allocations with
+    tracemalloc to record the heap peak of every stage, which slows tracing and emission down considerably."""
+    def __init__(self, enabled=True, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.epoch = time.perf_counter()
+        self.stages = []
+        self.calls = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return null_stage
+        return ThorinStage(self, name)
+
+    def record_call(self, function_name, elapsed):
+        calls = self.calls.get(function_name)
+        if calls is None:
+            calls = self.calls[function_name] = {"count": 0, "time": 0.0}
+        calls["count"] += 1
+        calls["time"] += elapsed
+
+    def summary(self):
+        """Stages of the same name added up."""
+        summary = {}
+        for stage in self.stages:
+            total = summary.setdefault(stage["name"], {"count": 0, "wall": 0.0, "cpu": 0.0})
+            total["count"] += 1
+            total["wall"] += stage["wall"]
+            total["cpu"] += stage["cpu"]
+        return summary
+
+    def to_dict(self):
+        return {"stages": self.stages, "summary": self.summary(), "calls": self.calls}
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def dump_trace(self, path):
+        """Writes the stages in the trace event format, to be opened with chrome://tracing or Perfetto."""
+        events = []
+        for stage in self.stages:
+            args = {key: value for key, value in stage.items() if key not in ("name", "start", "wall")}
+            events.append({"name": stage["name"], "ph": "X", "ts": stage["start"] * 1e6, "dur": stage["wall"] * 1e6, "pid": os.getpid(), "tid": 0, "args": args})
+        #Call statistics become counters at the time of the dump.
+        now = (time.perf_counter() - self.epoch) * 1e6
+        for function_name, calls in self.calls.items():
+            events.append({"name": function_name, "ph": "C", "ts": now, "pid": os.getpid(), "args": calls})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
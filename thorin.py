@@ -1,98 +1,533 @@
+import asyncio
+import hashlib
 import json
 import ctypes
 import os
+import shutil
 import subprocess
+import tempfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .type_table import *
 from .irbuilder import *
+from .world import *
+from .build_cache import *
+from .ffi import *
+from .library import *
+from .passes import *
+from .stats import *
+
+anyopt_flags = ["--emit-llvm"]
+clang_flags = ["-shared"]
+
+def scratch_dir(build_dir):
+    """build_dir is either a directory or True (also "1" or "tmpfs") for a memory backed one."""
+    if build_dir is True or build_dir in ("1", "tmpfs"):
+        if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+            return "/dev/shm"
+        return None
+    return build_dir
+
+def mounted_noexec(path):
+    """Whether path is on a file system mounted noexec, dlopen refuses libraries from there."""
+    try:
+        return bool(os.statvfs(path).f_flag & getattr(os, "ST_NOEXEC", 0))
+    except OSError:
+        return False
+
 
 class Thorin:
-    def __init__(self, module_name, module=False):
-        self.module = {"defs": [], "type_table": [], "module": module_name}
+    def __init__(self, module_name, module=False, cache_dir=None, batch=None, stream=False, passes=None, build_dir=None, stats=None, background=None, incremental=False):
+        if incremental and (stream or batch is not None or background is not None):
+            raise ValueError("incremental modules can't be streamed, batched or built in the background")
         self.module_name = module_name
+        #stats is True, False or "memory" to also record the Python heap peak of every stage, see ThorinStats.
+        if stats is None:
+            stats = os.environ.get("THORIN_STATS")
+            if stats != "memory":
+                stats = bool(stats)
+        self.stats = ThorinStats(bool(stats), stats == "memory")
+        self.keep = os.environ.get("KEEP_BUILD_FILES")
+
+        #Intermediate files of a module build go to a private directory under build_dir instead of the working directory.
+        if build_dir is None:
+            build_dir = os.environ.get("THORIN_BUILD_DIR")
+        self.build_dir = None
+        self.library_dir = None
+        self.build_prefix = module_name
+        self.library_prefix = module_name
+        if module and build_dir:
+            self.build_dir = tempfile.mkdtemp(prefix="thorin-", dir=scratch_dir(build_dir))
+            self.build_prefix = os.path.join(self.build_dir, os.path.basename(module_name))
+            self.library_prefix = self.build_prefix
+            if mounted_noexec(self.build_dir):
+                #/dev/shm is often noexec (the Docker default), the library itself goes to the regular temp directory.
+                self.library_dir = tempfile.mkdtemp(prefix="thorin-")
+                self.library_prefix = os.path.join(self.library_dir, os.path.basename(module_name))
+
+        self.streaming = stream
+        if stream:
+            self.module = ThorinWorld(module_name, open(self.build_prefix + ".thorin.json", "w"))
+        else:
+            self.module = ThorinWorld(module_name)
         self.compiled = False
         self.module_target = module
+        self.batch = batch
+        #None builds on exit, "thread" or "asyncio" start the build in the background instead.
+        self.background = background
+        self.build_future = None
+        #Definitions of the eagerly included modules; all includes, eager and lazy, in the order they were made.
         self.imported_definitions = {}
-        self.keep = os.environ.get("KEEP_BUILD_FILES")
+        self.libraries = []
+        self.resolved_definitions = {}
+
+        if cache_dir is None:
+            cache_dir = os.environ.get("THORIN_CACHE_DIR")
+        self.build_cache = ThorinBuildCache(cache_dir) if cache_dir else None
+        self.library_path = self.library_prefix + ".so"
+        self.build_files = []
+        #Libraries of other modules this one calls into, passed on to clang.
+        self.link_libraries = []
+
+        self.library = None
+        self.functions = {}
+        self.signatures = {}
+
+        #With passes, add_def only collects the roots; they are optimized and emitted together by emit_roots().
+        if passes is True:
+            passes = default_passes
+        self.pass_manager = ThorinPassManager(passes) if passes is not None else None
+        self.roots = []
+
+        #Incremental modules build every external function as a module of its own, see compile_incremental().
+        self.incremental = incremental
+        self.function_roots = {}
+        self.units = {}
+        self.unit_digests = {}
+        self.unit_failures = {}
 
-    #TODO: Use the thorin world for caching, don't cache information about the world inside defs.
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        #Don't build a half traced module, that would only bury the actual error.
+        if exc_type is not None:
+            return
+        if self.incremental:
+            if self.module_target:
+                self.compile_incremental()
+            return
+        self.emit_roots()
         if self.module_target:
-            self.compile_module()
+            if self.batch is not None:
+                self.batch.modules.append(self)
+            elif self.background == "asyncio":
+                self.compile_module_async()
+            elif self.background == "thread":
+                self.compile_module_future()
+            else:
+                self.compile_module()
+        elif self.streaming:
+            self.finish_stream()
         else:
-            with open(self.module_name + ".thorin.json", "w+") as f:
+            with self.stats.stage("serialize") as stage, open(self.module_name + ".thorin.json", "w+") as f:
                 json.dump(self.module, f, indent=2)
+                stage.info["size"] = f.tell()
 
     def __del__(self):
         #XXX: I have observed os to be none here, this might turn into a problem
-        if (self.keep is None or self.keep == "0") and self.module_target and self.compiled:
-            os.remove(self.module_name + ".thorin.json")
-            os.remove(self.module_name + ".ll")
-            os.remove(self.module_name + ".so")
+        #__init__ may have failed half way, don't rely on any attribute being set.
+        keep = getattr(self, "keep", None)
+        if (keep is None or keep == "0") and getattr(self, "module_target", False) and getattr(self, "compiled", False):
+            for build_file in getattr(self, "build_files", []):
+                os.remove(build_file)
+        if keep is None or keep == "0":
+            for directory in (getattr(self, "build_dir", None), getattr(self, "library_dir", None)):
+                if directory is not None:
+                    shutil.rmtree(directory, ignore_errors=True)
 
     def add_def(self, thorin_def):
-        assert(not self.compiled)
+        assert(self.incremental or not self.compiled)
 
-        return thorin_def.get(self.module)
+        if isinstance(thorin_def, ThorinContinuation) and thorin_def.external != "":
+            self.signatures[thorin_def.external] = thorin_def.type
+            if self.incremental:
+                #A new definition of an external function replaces the old one on the next compile_incremental().
+                self.function_roots[thorin_def.external] = thorin_def
+                self.roots.append(thorin_def)
+                return None
+        if self.incremental:
+            #Everything else is built as part of the external functions it is reachable from.
+            return None
+
+        if self.pass_manager is not None:
+            self.roots.append(thorin_def)
+            return None
+        with self.stats.stage("emit"):
+            return thorin_def.get(self.module)
+
+    def emit_roots(self):
+        if not self.roots:
+            return
+        with self.stats.stage("passes"):
+            self.pass_manager.run(self.roots)
+        with self.stats.stage("emit") as stage:
+            for root in self.roots:
+                root.get(self.module)
+            stage.info["defs"] = len(self.module["defs"])
+        self.roots = []
+
+    @property
+    def pass_report(self):
+        return self.pass_manager.report if self.pass_manager is not None else []
 
     def compile(self):
+        self.emit_roots()
+        if self.streaming:
+            self.finish_stream()
+            with open(self.build_prefix + ".thorin.json") as f:
+                return f.read()
         return json.dumps(self.module, indent=2)
 
+    def finish_stream(self):
+        stream = self.module.stream
+        if stream is not None:
+            self.module.close_stream()
+            stream.close()
+
     def compile_module(self):
-        with open(self.module_name + ".thorin.json", "w+") as f:
-            json.dump(self.module, f)
+        if not self.prepare_build():
+            self.run_toolchain()
+
+    def prepare_build(self):
+        """Serializes the module for the toolchain. Returns True if the build cache already holds the library."""
+        self.build_key = None
+        self.emit_roots()
+        if self.streaming:
+            self.finish_stream()
+            self.module_json = None
+            self.build_files.append(self.build_prefix + ".thorin.json")
+        else:
+            with self.stats.stage("serialize") as stage:
+                self.module_json = json.dumps(self.module, separators=(",", ":"))
+                stage.info["size"] = len(self.module_json)
+
+        if self.build_cache is not None:
+            with self.stats.stage("cache_lookup") as stage:
+                commands = [["anyopt", *anyopt_flags], ["clang", *clang_flags, *self.link_libraries]]
+                if self.module_json is None:
+                    with open(self.build_prefix + ".thorin.json", "rb") as f:
+                        self.build_key = self.build_cache.key(f, commands)
+                else:
+                    self.build_key = self.build_cache.key(self.module_json, commands)
+                library = self.build_cache.lookup(self.build_key)
+                stage.info["hit"] = library is not None
+            if library is not None:
+                self.library_path = library
+                self.module_json = None
+                self.compiled = True
+                return True
+
+        return False
+
+    def toolchain_steps(self):
+        """(stage, command, output) of every toolchain run, in order."""
+        return [
+            ("anyopt", ["anyopt", *anyopt_flags, "-o", self.build_prefix, self.build_prefix + ".thorin.json"], self.build_prefix + ".ll"),
+            ("clang", ["clang", *clang_flags, self.build_prefix + ".ll", *self.link_libraries, "-o", self.library_prefix + ".so"], self.library_prefix + ".so"),
+        ]
+
+    def write_module_json(self):
+        if self.module_json is not None:
+            with open(self.build_prefix + ".thorin.json", "w+") as f:
+                f.write(self.module_json)
+            self.module_json = None
+            self.build_files.append(self.build_prefix + ".thorin.json")
+
+    def run_toolchain(self):
+        self.write_module_json()
+        for stage_name, command, output in self.toolchain_steps():
+            with self.stats.stage(stage_name) as stage:
+                stage.run(command)
+                stage.info["size"] = os.path.getsize(output)
+        self.finish_toolchain()
+
+    async def run_toolchain_async(self):
+        self.write_module_json()
+        for stage_name, command, output in self.toolchain_steps():
+            with self.stats.stage(stage_name) as stage:
+                process = await asyncio.create_subprocess_exec(*command)
+                returncode = await process.wait()
+                if returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, command)
+                stage.info["size"] = os.path.getsize(output)
+        self.finish_toolchain()
+
+    def finish_toolchain(self):
+        self.build_files += [self.build_prefix + ".ll", self.library_prefix + ".so"]
+        #dlopen only looks into the working directory for names that contain a slash.
+        self.library_path = os.path.abspath(self.library_prefix + ".so")
+
+        if self.build_key is not None:
+            self.library_path = self.build_cache.store(self.build_key, self.library_prefix + ".so", self.build_prefix + ".ll")
+
+        self.compiled = True
+
+    def compile_module_async(self):
+        """Builds the module on the running event loop, anyopt and clang run as asyncio subprocesses.
+        Emission, serialization, the cache lookup and writing the json run on the build thread pool, off the loop.
+        Returns the task; await it, or get_function_async(), before using the module."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError("%s: building in the background with asyncio needs a running event loop" % self.module_name) from None
+
+        async def build():
+            if not await loop.run_in_executor(build_executor(), self.prepare_build):
+                await loop.run_in_executor(build_executor(), self.write_module_json)
+                await self.run_toolchain_async()
+            return self
+
+        self.build_future = loop.create_task(build())
+        return self.build_future
+
+    def compile_module_future(self, executor=None):
+        """Builds the module on executor (a shared thread pool by default). Returns a concurrent.futures.Future."""
+        if executor is None:
+            executor = build_executor()
+
+        def build():
+            self.compile_module()
+            return self
 
-        subprocess.run(["anyopt", "--emit-llvm", "-o", self.module_name, self.module_name + ".thorin.json"])
-        subprocess.run(["clang", "-shared", self.module_name + ".ll", "-o", self.module_name + ".so"])
+        self.build_future = executor.submit(build)
+        return self.build_future
+
+    async def get_function_async(self, function_name):
+        """get_function that first waits for a build started in the background."""
+        if not self.compiled and self.build_future is not None:
+            await asyncio.wrap_future(self.build_future)
+        return self.get_function(function_name)
+
+    def compile_incremental(self):
+        """Builds the external functions as libraries of their own, each together with the internal defs reachable from it.
+
+        A call to another external function of this module is emitted as a declaration and its library is linked
+        in. Mutually recursive functions share a library, as do functions using the same mutable or external
+        global. Only libraries whose emitted module or dependencies changed since the last call are rebuilt, with
+        a build cache only those that were never built before. Functions can be added or redefined between calls.
+        Internal continuations and immutable globals reachable from several functions are compiled into each of
+        their libraries, they hold no state that could diverge.
+
+        All libraries that can be built are, a RuntimeError naming the failed functions is raised afterwards;
+        the errors themselves are kept in unit_failures."""
+        if self.pass_manager is not None and self.roots:
+            with self.stats.stage("passes"):
+                self.pass_manager.run(self.roots)
+        self.roots = []
+
+        #Every unit gets a private build directory, a rebuilt library must not reuse the path dlopen already knows.
+        build_dir = self.build_dir if self.build_dir is not None else tempfile.gettempdir()
+        cache_dir = self.build_cache.cache_dir if self.build_cache is not None else None
+
+        callees = {}
+        users = {}
+        for function_name, root in self.function_roots.items():
+            callees[function_name], state = self.function_references(root)
+            for state_def in state:
+                users.setdefault(state_def, set()).add(function_name)
+
+        #A copy of a mutable or external global per library would split its state, functions sharing one are
+        #built together: they get edges both ways, just like mutually recursive functions.
+        graph = {function_name: set(calls) for function_name, calls in callees.items()}
+        for function_names in users.values():
+            for function_name in function_names:
+                graph[function_name] |= function_names - {function_name}
+        components = call_graph_components(graph)
+        component_of = {function_name: component for component in components for function_name in component}
+
+        #Dependencies come first, a unit's digest includes theirs so that callers are relinked when a callee changes.
+        digests = {}
+        depths = {}
+        changed = []
+        with self.stats.stage("incremental") as stage:
+            for component in components:
+                dependencies = sorted({component_of[callee] for function_name in component for callee in callees[function_name]} - {component})
+                unit = Thorin(self.module_name + "_" + "_".join(component), module=True, cache_dir=cache_dir, build_dir=build_dir)
+
+                declarations = {}
+                for function_name in component:
+                    for callee, callee_defs in callees[function_name].items():
+                        if callee in component:
+                            continue
+                        declaration = declarations.get(callee)
+                        if declaration is None:
+                            declaration = declarations[callee] = ThorinContinuation(callee_defs[0].type, external=callee).get(unit.module)
+                        for callee_def in callee_defs:
+                            unit.module.names[callee_def] = declaration
+                for function_name in component:
+                    unit.add_def(self.function_roots[function_name])
+
+                digest = hashlib.sha256(json.dumps(unit.module, separators=(",", ":")).encode("utf-8"))
+                for dependency in dependencies:
+                    digest.update(digests[dependency].encode("utf-8"))
+                digests[component] = digest.hexdigest()
+                depths[component] = 1 + max([depths[dependency] for dependency in dependencies], default=-1)
+
+                if any(self.unit_digests.get(function_name) != digests[component] for function_name in component):
+                    changed.append((component, unit, dependencies))
+            stage.info["functions"] = len(self.function_roots)
+            stage.info["changed"] = sum([len(component) for component, unit, dependencies in changed])
+
+        #Units of the same depth don't depend on each other and are built together.
+        built = {}
+        failures = {}
+        for depth in sorted({depths[component] for component, unit, dependencies in changed}):
+            wave = []
+            for component, unit, dependencies in changed:
+                if depths[component] != depth:
+                    continue
+                failed = [dependency for dependency in dependencies if dependency in failures]
+                if failed:
+                    failures[component] = RuntimeError("%s not built, it calls %s" % (", ".join(component), ", ".join(failed[0])))
+                    continue
+                dependency_units = [built[dependency] if dependency in built else self.units[dependency[0]] for dependency in dependencies]
+                unit.link_libraries = [os.path.abspath(dependency_unit.library_path) for dependency_unit in dependency_units]
+                wave.append((component, unit))
+
+            for (component, unit), (thorin, error) in zip(wave, compile_modules([unit for component, unit in wave])):
+                if error is not None:
+                    failures[component] = error
+                else:
+                    built[component] = unit
+
+        for component, unit in built.items():
+            for function_name in component:
+                self.units[function_name] = unit
+                self.unit_digests[function_name] = digests[component]
+                self.functions.pop(function_name, None)
 
         self.compiled = True
+        self.unit_failures = {function_name: error for component, error in failures.items() for function_name in component}
+        if failures:
+            first_error = next(iter(failures.values()))
+            raise RuntimeError("failed to build %s" % ", ".join(sorted(self.unit_failures))) from first_error
 
-    def call_function(self, function_name, *args):
-        assert(self.compiled)
+    def function_references(self, root):
+        """What root refers to outside of its own unit: the other functions of an incremental module it calls, as
+        name -> the continuations referring to them (an earlier definition may still be referenced), and the
+        mutable or external globals it uses. The bodies of the called functions are not looked into."""
+        callees = {}
+        state = set()
+        visited = {root}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for operand in [*node.operands(), *node.late_operands()]:
+                if not isinstance(operand, ThorinNode) or operand in visited:
+                    continue
+                visited.add(operand)
+                if isinstance(operand, ThorinContinuation) and operand.external != root.external and operand.external in self.function_roots:
+                    callees.setdefault(operand.external, []).append(operand)
+                    continue
+                if isinstance(operand, ThorinGlobal) and (operand.mutable or operand.external is not None):
+                    state.add(operand)
+                stack.append(operand)
+        return callees, state
 
-        libc = ctypes.CDLL(self.module_name + ".so")
+    def get_function(self, function_name):
+        """The ctypes function for an exported symbol, with argtypes and restype set when the signature is known."""
+        function = self.functions.get(function_name)
+        if function is None and self.incremental:
+            function = self.units[function_name].get_function(function_name)
+            self.functions[function_name] = function
+        if function is None:
+            if not self.compiled and self.build_future is not None:
+                #Blocks on a thread build; an unfinished asyncio build raises InvalidStateError, use get_function_async.
+                self.build_future.result()
+            assert(self.compiled)
 
-        return libc[function_name](*args)
+            if self.library is None:
+                with self.stats.stage("load"):
+                    self.library = ctypes.CDLL(self.library_path)
+            function = self.library[function_name]
 
-    def include(self, module_file):
-        if module_file.endswith(".art"):
-            subprocess.run(["artic", "--emit-json", "-o", module_file[:-4], module_file])
-            module_file = module_file[:-4] + ".thorin.json"
-            #TODO: Mark these files for deletion if not required.
+            signature = self.signatures.get(function_name)
+            if signature is not None:
+                fn_ctypes = thorin_fn_ctypes(signature)
+                if fn_ctypes is not None:
+                    function.argtypes, function.restype = fn_ctypes
+                    function = thorin_fn_wrapper(function, signature)
 
-        with open(module_file) as f:
-            extern_module = json.load(f)
+            self.functions[function_name] = function
+        return function
 
-        imported_type_table = {}
-        for extern_type in extern_module["type_table"]:
-            imported_type_table.update(ThorinType.import_type(extern_type, imported_type_table))
+    def call_function(self, function_name, *args, **kwargs):
+        function = self.get_function(function_name)
+        if not self.stats.enabled:
+            return function(*args, **kwargs)
 
-        for definition in extern_module["defs"]:
-            if "internal" in definition:
-                imported_type = imported_type_table[definition["fn_type"]]
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.stats.record_call(function_name, time.perf_counter() - start)
 
-                imported_def = ThorinContinuation(imported_type, internal=definition["internal"]) # XXX: These continuations can only be used in a specific order with the imported files!
-                self.imported_definitions.update({definition["internal"]: imported_def})
+    def include(self, module_file, lazy=False):
+        library = ThorinLibrary.load(module_file, self.build_cache, lazy)
+        self.libraries.append(library)
+        #A new include may shadow names that were already looked up.
+        self.resolved_definitions = {}
+        if not lazy:
+            self.imported_definitions.update(library.definitions)
 
     def find_imported_def(self, function_name):
-        return self.imported_definitions[function_name]
+        imported_def = self.resolved_definitions.get(function_name)
+        if imported_def is None:
+            #Later includes take precedence, whether they were imported eagerly or lazily.
+            for library in reversed(self.libraries):
+                imported_def = library.find(function_name)
+                if imported_def is not None:
+                    self.resolved_definitions[function_name] = imported_def
+                    break
+            else:
+                raise KeyError(function_name)
+        return imported_def
 
     def __getattr__(self, function_name):
-        return lambda *args : self.call_function(function_name, *args)
+        if function_name.startswith("__"):
+            raise AttributeError(function_name)
+        #Only reached for missing attributes: before __init__ set these up, they must not recurse into here.
+        if "compiled" not in self.__dict__ or "stats" not in self.__dict__:
+            raise AttributeError(function_name)
+        if self.compiled and not self.stats.enabled:
+            return self.get_function(function_name)
+        return lambda *args, **kwargs : self.call_function(function_name, *args, **kwargs)
 
     def compile_function_jit(self, name, function, return_type, arg_types):
+        """Traces function with parameters of arg_types into the exported continuation name.
+        With return_type None, the return type is taken from the traced result. Returns the return type."""
         mem_type = ThorinMemType()
-        ret_fn_type = ThorinFnType([mem_type, return_type])
+        ret_fn_type = ThorinFnType([mem_type] if return_type is None else [mem_type, return_type])
         fn_type = ThorinFnType([mem_type, *arg_types, ret_fn_type])
 
         with ThorinContinuation(fn_type, external=name, thorin=self) as (thorin_fn, mem_param, *param_list, ret_param):
-            res = function(*param_list)
+            with self.stats.stage("trace"):
+                res = thorinOperand(function(*param_list))
+
+            if return_type is None:
+                return_type = thorinTypeOf(res)
+                if return_type is None:
+                    raise TypeError("can't infer the return type of %s, pass it explicitly" % name)
+                #Nothing is emitted before the continuation is closed, so the type can still be completed.
+                ret_fn_type.args.append(return_type)
 
             thorin_fn(ret_param, mem_param, res)
 
+        return return_type
+
 
         # Step 1: The function is "executed" with thorin values that track the operations in the function.
         #        This reqires some special precautions, for instance, range needs to be replaced. This is not a full fledged compiler, just a weird description system.
@@ -102,3 +537,104 @@ class Thorin:
         # Step 5: Link this file in and import the compiled function.
 
         # Design consideration: I would guess it to be a bad idea to build a thorin program that can deal with Python objects. Consequently, I need a translational layer. I would guess ctypes can be used to call pure C functions in .so files.?
+
+
+_build_executor = None
+_build_executor_lock = threading.Lock()
+
+def build_executor():
+    global _build_executor
+    with _build_executor_lock:
+        if _build_executor is None:
+            _build_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="thorin-build")
+    return _build_executor
+
+
+def call_graph_components(callees):
+    """The strongly connected components of a call graph given as name -> set of called names, as sorted tuples
+    of names. A component comes after all components it calls into."""
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for start in sorted(callees):
+        if start in index:
+            continue
+        #Iterative Tarjan, work holds (name, remaining callees).
+        work = [(start, iter(sorted(callees[start])))]
+        index[start] = lowlink[start] = len(index)
+        stack.append(start)
+        on_stack.add(start)
+        while work:
+            name, remaining = work[-1]
+            for callee in remaining:
+                if callee not in index:
+                    index[callee] = lowlink[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(sorted(callees[callee]))))
+                    break
+                if callee in on_stack:
+                    lowlink[name] = min(lowlink[name], index[callee])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[name])
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    components.append(tuple(sorted(component)))
+    return components
+
+
+def compile_modules(thorin_modules, max_workers=None):
+    """Compiles several modules at once.
+
+    The modules are serialized one after the other, the anyopt and clang runs of all modules that miss
+    the build cache are spread over a pool of max_workers threads (one per core by default).
+    Returns a list of (thorin, error) pairs in the order of thorin_modules, error is None on success."""
+    errors = {}
+    pending = []
+    for thorin in thorin_modules:
+        try:
+            if not thorin.prepare_build():
+                pending.append(thorin)
+        except Exception as error:
+            errors[id(thorin)] = error
+
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [(thorin, pool.submit(thorin.run_toolchain)) for thorin in pending]
+            for thorin, future in futures:
+                errors[id(thorin)] = future.exception()
+
+    return [(thorin, errors.get(id(thorin))) for thorin in thorin_modules]
+
+
+class ThorinBatch:
+    """Collects Thorin(..., module=True, batch=batch) modules and compiles them together with compile_modules on exit."""
+    def __init__(self, max_workers=None):
+        self.modules = []
+        self.max_workers = max_workers
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.results = compile_modules(self.modules, self.max_workers)
+
+    def failures(self):
+        return [(thorin, error) for thorin, error in self.results if error is not None]
@@ -1,12 +1,8 @@
-class ThorinType:
-    def __init__(self):
-        self.cache = ""
-    def get(self, module):
-        if self.cache == "":
-            self.cache = self.compile(module)
-        return self.cache
-    def compile(self, module):
-        raise Exception("Not implemented")
+from .world import ThorinNode
+
+class ThorinType(ThorinNode):
+    __slots__ = ()
+
     @staticmethod
     def import_type(type_entry, current_mapping):
         new_name = type_entry["name"]
@@ -40,6 +36,9 @@ class ThorinType:
 
 
 class ThorinDefiniteArrayType(ThorinType):
+    __slots__ = ("target_type", "length")
+    operand_fields = ("target_type",)
+
     def __init__(self, target_type, length):
         super().__init__()
         self.target_type = target_type
@@ -48,12 +47,7 @@ class ThorinDefiniteArrayType(ThorinType):
     def compile(self, module):
         target_type = self.target_type.get(module)
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_def_array_" + str(save_index)
-
-        type_table.append({"type": "def_array", "name": name, "length": self.length, "args": [target_type]})
-        return name
+        return module.add_type("_def_array_", {"type": "def_array", "length": self.length, "args": [target_type]})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -64,6 +58,9 @@ class ThorinDefiniteArrayType(ThorinType):
 
 
 class ThorinIndefiniteArrayType(ThorinType):
+    __slots__ = ("target_type",)
+    operand_fields = ("target_type",)
+
     def __init__(self, target_type):
         super().__init__()
         self.target_type = target_type
@@ -71,12 +68,7 @@ class ThorinIndefiniteArrayType(ThorinType):
     def compile(self, module):
         target_type = self.target_type.get(module)
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_indef_array_" + str(save_index)
-
-        type_table.append({"type": "indef_array", "name": name, "args": [target_type]})
-        return name
+        return module.add_type("_indef_array_", {"type": "indef_array", "args": [target_type]})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -86,16 +78,13 @@ class ThorinIndefiniteArrayType(ThorinType):
 
 
 class ThorinBottomType(ThorinType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
     def compile(self, module):
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_bottom_" + str(save_index)
-
-        type_table.append({"type": "bottom", "name": name})
-        return name
+        return module.add_type("_bottom_", {"type": "bottom"})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -103,6 +92,9 @@ class ThorinBottomType(ThorinType):
 
 
 class ThorinFnType(ThorinType):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     #TODO: always add a mem argument; with an option to disable it if needed.
     #Rationale: All explicit instances that I use end up using a mem argument anyways.
     def __init__(self, args, return_type=None):
@@ -126,12 +118,7 @@ class ThorinFnType(ThorinType):
         for arg in self.args:
             args.append(arg.get(module))
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_fn_" + str(save_index)
-
-        type_table.append({"type": "function", "name": name, "args": args})
-        return name
+        return module.add_type("_fn_", {"type": "function", "args": args})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -141,6 +128,9 @@ class ThorinFnType(ThorinType):
 
 
 class ThorinClosureType(ThorinType):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self):
         super().__init__()
         assert(False)
@@ -150,12 +140,7 @@ class ThorinClosureType(ThorinType):
         for arg in self.args:
             args.append(arg.get(module))
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_closure_" + str(save_index)
-
-        type_table.append({"type": "closure", "name": name, "args": args})
-        return name
+        return module.add_type("_closure_", {"type": "closure", "args": args})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -165,16 +150,13 @@ class ThorinClosureType(ThorinType):
 
 
 class ThorinFrameType(ThorinType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
     def compile(self, module):
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_frame_" + str(save_index)
-
-        type_table.append({"type": "frame", "name": name})
-        return name
+        return module.add_type("_frame_", {"type": "frame"})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -182,16 +164,13 @@ class ThorinFrameType(ThorinType):
 
 
 class ThorinMemType(ThorinType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
     def compile(self, module):
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_mem_" + str(save_index)
-
-        type_table.append({"type": "mem", "name": name})
-        return name
+        return module.add_type("_mem_", {"type": "mem"})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -199,6 +178,8 @@ class ThorinMemType(ThorinType):
 
 
 class ThorinStructType(ThorinType):
+    __slots__ = ("struct_name", "formated_args")
+
     def __init__(self, struct_name, formated_args=None):
         super().__init__()
         self.struct_name = struct_name
@@ -210,20 +191,27 @@ class ThorinStructType(ThorinType):
         type_table = module["type_table"]
         save_index = len(type_table)
         name = "_struct_" + str(save_index)
-        self.cache = name
 
         arg_names = []
         for arg_name, arg in self.formated_args:
             arg_names.append(arg_name)
 
         type_table.append({"type": "struct", "name": name, "struct_name": self.struct_name, "arg_names": arg_names})
+        return name
 
+    def late_operands(self):
+        return [arg for arg_name, arg in self.formated_args]
+
+    def finish(self, module):
+        name = self.get(module)
+
+        arg_names = []
         args = []
         for arg_name, arg in self.formated_args:
+            arg_names.append(arg_name)
             args.append(arg.get(module))
 
-        type_table.append({"type": "struct", "name": name, "struct_name": self.struct_name, "arg_names": arg_names, "args": args})
-        return name
+        module["type_table"].append({"type": "struct", "name": name, "struct_name": self.struct_name, "arg_names": arg_names, "args": args})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -246,6 +234,8 @@ class ThorinStructType(ThorinType):
 
 
 class ThorinVariantType(ThorinType):
+    __slots__ = ("variant_name", "formated_args")
+
     def __init__(self, variant_name, formated_args=None):
         super().__init__()
         self.variant_name = variant_name
@@ -257,20 +247,27 @@ class ThorinVariantType(ThorinType):
         type_table = module["type_table"]
         save_index = len(type_table)
         name = "_variant_" + str(save_index)
-        self.cache = name
 
         arg_names = []
-        for name, arg in self.formated_args:
-            arg_names.append(name)
+        for arg_name, arg in self.formated_args:
+            arg_names.append(arg_name)
 
         type_table.append({"type": "variant", "name": name, "variant_name": self.variant_name, "arg_names": arg_names})
+        return name
 
+    def late_operands(self):
+        return [arg for arg_name, arg in self.formated_args]
+
+    def finish(self, module):
+        name = self.get(module)
+
+        arg_names = []
         args = []
-        for name, arg in self.formated_args:
+        for arg_name, arg in self.formated_args:
+            arg_names.append(arg_name)
             args.append(arg.get(module))
 
-        type_table.append({"type": "variant", "name": name, "arg_names": arg_names, "args": args})
-        return name
+        module["type_table"].append({"type": "variant", "name": name, "arg_names": arg_names, "args": args})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -293,6 +290,9 @@ class ThorinVariantType(ThorinType):
 
 
 class ThorinTupleType(ThorinType):
+    __slots__ = ("args",)
+    operand_fields = ("args",)
+
     def __init__(self, args):
         super().__init__()
         self.args = args
@@ -302,12 +302,7 @@ class ThorinTupleType(ThorinType):
         for arg in self.args:
             args.append(arg.get(module))
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_tuple_" + str(save_index)
-
-        type_table.append({"type": "tuple", "name": name, "args": args})
-        return name
+        return module.add_type("_tuple_", {"type": "tuple", "args": args})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -317,6 +312,8 @@ class ThorinTupleType(ThorinType):
 
 
 class ThorinPrimType(ThorinType):
+    __slots__ = ("tag", "length")
+
     def __init__(self, tag, length=1):
         super().__init__()
         self.tag = tag
@@ -326,12 +323,7 @@ class ThorinPrimType(ThorinType):
         tag = self.tag
         length = self.length
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_prim_" + str(save_index)
-
-        type_table.append({"type": "prim", "name": name, "tag": tag, "length": length})
-        return name
+        return module.add_type("_prim_", {"type": "prim", "tag": tag, "length": length})
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -344,6 +336,9 @@ class ThorinPrimType(ThorinType):
 
 
 class ThorinPointerType(ThorinType):
+    __slots__ = ("pointee", "length", "device", "addrspace")
+    operand_fields = ("pointee",)
+
     def __init__(self, pointee, length=1, device=None, addrspace=None):
         super().__init__()
         self.pointee = pointee
@@ -355,18 +350,13 @@ class ThorinPointerType(ThorinType):
         pointee = self.pointee.get(module)
         length = self.length
 
-        type_table = module["type_table"]
-        save_index = len(type_table)
-        name = "_ptr_" + str(save_index)
-
-        my_def = {"type": "ptr", "name": name, "length": length, "args": [pointee]}
+        my_def = {"type": "ptr", "length": length, "args": [pointee]}
         if self.device:
-            my_def.update({"device": device})
+            my_def.update({"device": self.device})
         if self.addrspace:
-            my_def.update({"addrspace": addrspace})
+            my_def.update({"addrspace": self.addrspace})
 
-        type_table.append(my_def)
-        return name
+        return module.add_type("_ptr_", my_def)
 
     @staticmethod
     def reconstruct(type_entry, current_mapping):
@@ -0,0 +1,171 @@
+import json
+import shutil
+import tempfile
+
+def freeze_entry(entry):
+    #Floats are keyed on their exact bits, 0.0 == -0.0 and NaN != NaN would merge or split constants.
+    return tuple([(key, tuple(value) if value.__class__ is list else (value.hex() if value.__class__ is float else value)) for key, value in entry.items()])
+
+
+class ThorinNode:
+    """Common base of defs and types: a node in the emission graph."""
+    __slots__ = ()
+
+    #Attributes that hold the nodes (or lists of nodes) this node refers to, in emission order.
+    operand_fields = ()
+
+    def get(self, module):
+        name = module.names.get(self)
+        if name is None:
+            name = module.emit(self)
+        return name
+    def compile(self, module):
+        raise Exception("Not implemented")
+
+    def operands(self):
+        """Nodes that have to be emitted before this one."""
+        operands = []
+        for field in self.operand_fields:
+            value = getattr(self, field)
+            if isinstance(value, (list, tuple)):
+                operands.extend(value)
+            elif value is not None:
+                operands.append(value)
+        return operands
+
+    def replace_operands(self, replace):
+        """Swaps every operand that has an entry in replace for its replacement."""
+        for field in self.operand_fields:
+            value = getattr(self, field)
+            if isinstance(value, (list, tuple)):
+                setattr(self, field, [replace.get(operand, operand) for operand in value])
+            elif value is not None:
+                setattr(self, field, replace.get(value, value))
+
+    def late_operands(self):
+        """Nodes that are emitted after this one got its name, see finish()."""
+        return ()
+    def finish(self, module):
+        pass
+
+
+compact_encoder = json.JSONEncoder(separators=(",", ":"))
+
+class ThorinStreamTable:
+    """Stands in for the defs or type_table list: entries are written out as soon as they are appended."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, entry):
+        if self.length:
+            self.stream.write(",")
+        self.stream.write(compact_encoder.encode(entry))
+        self.length += 1
+
+
+class ThorinWorld(dict):
+    """The module dict that gets dumped to json, plus the tables used while emitting into it.
+
+    With a stream, defs are written to it while they are emitted instead of being collected; types go to a
+    spooled temporary file and are copied behind the defs by close_stream()."""
+    def __init__(self, module_name, stream=None):
+        self.stream = stream
+        if stream is None:
+            super().__init__({"defs": [], "type_table": [], "module": module_name})
+        else:
+            self.type_stream = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024, mode="w+")
+            stream.write('{"defs":[')
+            super().__init__({"defs": ThorinStreamTable(stream), "type_table": ThorinStreamTable(self.type_stream), "module": module_name})
+
+        #Emitted name of every node, so the same def graph can be emitted into several worlds.
+        self.names = {}
+
+        #Structural types are hash-consed: identical entries share one name.
+        self.type_numbers = {}
+        self.collapsed_types = 0
+
+        #Pure defs are value-numbered the same way; effectful and nominal defs always get a fresh entry.
+        self.def_numbers = {}
+        self.collapsed_defs = 0
+
+        #Name of the declaration of every (intrinsic, fn type) pair.
+        self.intrinsics = {}
+
+    def close_stream(self):
+        self.stream.write('],"type_table":[')
+        self.type_stream.seek(0)
+        shutil.copyfileobj(self.type_stream, self.stream)
+        self.type_stream.close()
+        self.stream.write('],"module":' + compact_encoder.encode(self["module"]) + "}")
+        self.stream = None
+
+    def add_type(self, prefix, entry):
+        key = freeze_entry(entry)
+        name = self.type_numbers.get(key)
+        if name is not None:
+            self.collapsed_types += 1
+            return name
+
+        type_table = self["type_table"]
+        save_index = len(type_table)
+        name = prefix + str(save_index)
+
+        type_table.append({"type": entry["type"], "name": name, **entry})
+        self.type_numbers[key] = name
+        return name
+
+    def add_def(self, prefix, entry):
+        def_table = self["defs"]
+        save_index = len(def_table)
+        name = prefix + str(save_index)
+
+        def_table.append({"type": entry["type"], "name": name, **entry})
+        return name
+
+    def add_pure_def(self, prefix, entry):
+        key = freeze_entry(entry)
+        name = self.def_numbers.get(key)
+        if name is not None:
+            self.collapsed_defs += 1
+            return name
+
+        name = self.add_def(prefix, entry)
+        self.def_numbers[key] = name
+        return name
+
+    def emit(self, root):
+        #Post-order walk with an explicit stack, so deep graphs don't run into the recursion limit.
+        #Nodes that can be part of a cycle (continuations, nominal types) are named by compile() first,
+        #their late operands are emitted afterwards and finish() completes their entry.
+        names = self.names
+        stack = [(root, 0)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, state = pop()
+            if state == 2:
+                node.finish(self)
+                continue
+            if node in names:
+                continue
+
+            if state == 0:
+                pending = [(operand, 0) for operand in node.operands() if operand not in names]
+                if pending:
+                    push((node, 1))
+                    pending.reverse()
+                    stack.extend(pending)
+                    continue
+
+            names[node] = node.compile(self)
+            late_operands = node.late_operands()
+            if late_operands:
+                push((node, 2))
+                pending = [(operand, 0) for operand in late_operands if operand not in names]
+                pending.reverse()
+                stack.extend(pending)
+        return names[root]